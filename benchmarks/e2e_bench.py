@@ -0,0 +1,308 @@
+"""bot.py handlerlarini Firestore emulatorida boshidan oxirigacha o'lchash.
+
+    gcloud emulators firestore start --host-port=localhost:8080
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python benchmarks/e2e_bench.py --users 10000 --channels 8 --out before.json
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python benchmarks/e2e_bench.py --users 10000 --channels 8 --compare before.json
+
+Har bir flow: /start -> mark_requested (har bir yopiq kanal uchun) -> check_subs, keyin admin statistika
+ekranlari. Telegram obyektlari stub, get_chat_member sun'iy kechikish bilan javob beradi.
+Natija: qadamlar bo'yicha p50/p95/p99, flow uchun Firestore RPC/o'qish/yozish, xotira - JSON.
+"""
+import os
+import sys
+import json
+import time
+import random
+import secrets
+import asyncio
+import argparse
+import resource
+import contextlib
+import subprocess
+import tracemalloc
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+    sys.exit("FIRESTORE_EMULATOR_HOST o'rnatilmagan - benchmark faqat emulatorda ishlaydi")
+os.environ.pop("FIREBASE_CREDENTIALS", None)
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("PROMO_CODE_KEY", secrets.token_hex(32))
+
+import bot
+import metrics
+import repository
+
+ADMIN_ID = bot.ADMIN_IDS[0]
+USER_ID_BASE = 10_000_000
+ADMIN_VIEWS = ['admin_stats', 'admin_users', 'admin_codes', 'admin_requests_stats']
+
+
+# ============================================================
+# TELEGRAM STUBLARI
+# ============================================================
+
+class StubMessage:
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.message_id = 1
+
+    async def reply_text(self, text, **kwargs):
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        return self
+
+    async def reply_document(self, document, **kwargs):
+        return self
+
+
+class StubUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.first_name = f"bench{user_id}"
+        self.full_name = self.first_name
+
+
+class StubCallbackQuery:
+    def __init__(self, user, data):
+        self.from_user = user
+        self.data = data
+        self.message = StubMessage(user.id)
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+
+class StubUpdate:
+    def __init__(self, user_id, data=None):
+        self.effective_user = StubUser(user_id)
+        self.callback_query = StubCallbackQuery(self.effective_user, data) if data else None
+        self.message = None if data else StubMessage(user_id)
+
+
+class StubMember:
+    def __init__(self, status):
+        self.status = status
+
+
+class StubBot:
+    """get_chat_member: Telegram javobini sun'iy kechikish bilan taqlid qilish"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def get_chat_member(self, chat_id, user_id, **kwargs):
+        await asyncio.sleep(self.latency)
+        return StubMember('member')
+
+
+class StubContext:
+    def __init__(self, bot_stub):
+        self.bot = bot_stub
+        self.args = []
+        self.application = None
+
+
+# ============================================================
+# MA'LUMOTLAR
+# ============================================================
+
+def clear_emulator():
+    project = os.getenv("GOOGLE_CLOUD_PROJECT", "tdm-bot-local")
+    url = f"http://{os.environ['FIRESTORE_EMULATOR_HOST']}/emulator/v1/projects/{project}/databases/(default)/documents"
+    urllib.request.urlopen(urllib.request.Request(url, method='DELETE')).read()
+
+
+def make_channels(count):
+    """Aralash kanal ro'yxati: ~50% ochiq, ~35% yopiq (so'rov), qolgani havola"""
+    channels = []
+    for i in range(count):
+        kind = ('channel', 'request', 'channel', 'link', 'request', 'channel')[i % 6]
+        channels.append({
+            'id': f"-100{1000 + i}" if kind != 'link' else f"link{i}",
+            'name': f"Bench {kind} {i}",
+            'url': f"https://t.me/+bench{i}" if kind == 'request' else f"https://t.me/bench{i}",
+            'type': kind,
+        })
+    return channels
+
+
+async def seed(users, channels, task_version, batch_size=500, parallel=8):
+    await repository.save_channels(channels)
+    await repository.set_task_version(task_version)
+    await repository.set_promo_coins(bot.PROMO_COIN_AMOUNT)
+    # Benchmark migratsiyadan keyingi holatni o'lchaydi (user_requests fallback siz)
+    await repository.adb.collection('bot_config').document('settings').set({'requests_migrated': True}, merge=True)
+
+    async def write_batch(start):
+        batch = repository.adb.batch()
+        for uid in range(start, min(start + batch_size, users)):
+            user_id = str(USER_ID_BASE + uid)
+            # Populyatsiyaning chorak qismi oldingi versiyani bajargan, bir qismida kod bor
+            completed = task_version - 1 if uid % 4 == 0 else 0
+            batch.set(repository.adb.collection('bot_users').document(user_id), {
+                'telegram_uid': user_id,
+                'telegram_name': f"bench{user_id}",
+                'completed_version': completed,
+                'has_unused_code': completed > 0,
+            })
+        await batch.commit()
+
+    starts = list(range(0, users, batch_size))
+    for i in range(0, len(starts), parallel):
+        await asyncio.gather(*(write_batch(start) for start in starts[i:i + parallel]))
+
+    codes = repository.adb.batch()
+    for i in range(min(users // 4, batch_size)):
+        user = StubUser(USER_ID_BASE + i * 4)
+        code = f"BENCH{i:04d}"
+        codes.set(repository.adb.collection('promo_codes').document(code),
+                  repository.promo_code_data(code, user, task_version - 1, bot.PROMO_COIN_AMOUNT))
+    await codes.commit()
+    await repository.refill_code_pool(repository.CODE_POOL_TARGET)
+
+
+# ============================================================
+# O'LCHASH
+# ============================================================
+
+async def run_flow(bot_stub, user_id, request_channels):
+    context = StubContext(bot_stub)
+    await bot.start(StubUpdate(user_id), context)
+    for _ in range(request_channels):
+        await bot.mark_requested(StubUpdate(user_id, 'mark_requested'), context)
+    await bot.check_subscriptions(StubUpdate(user_id, 'check_subs'), context)
+
+
+async def run_admin_views(rounds):
+    context = StubContext(None)
+    for _ in range(rounds):
+        for view in ADMIN_VIEWS:
+            await bot.admin_callback(StubUpdate(ADMIN_ID, view), context)
+
+
+def summarize(entries):
+    steps = {}
+    for name in sorted({entry[1] for entry in entries}):
+        rows = [entry for entry in entries if entry[1] == name]
+        durations = sorted(entry[2] for entry in rows)
+        steps[name] = {
+            'count': len(rows),
+            'mean_ms': round(sum(durations) / len(rows) * 1000, 2),
+            'p50_ms': round(metrics.percentile(durations, 0.50) * 1000, 2),
+            'p95_ms': round(metrics.percentile(durations, 0.95) * 1000, 2),
+            'p99_ms': round(metrics.percentile(durations, 0.99) * 1000, 2),
+            'rpcs': round(sum(entry[3] for entry in rows) / len(rows), 2),
+            'reads': round(sum(entry[4] for entry in rows) / len(rows), 2),
+            'writes': round(sum(entry[5] for entry in rows) / len(rows), 2),
+        }
+    return steps
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except Exception:
+        return None
+
+
+async def benchmark(args):
+    random.seed(args.seed)
+    channels = make_channels(args.channels)
+    request_channels = sum(1 for ch in channels if ch['type'] == 'request')
+
+    if not args.no_seed:
+        clear_emulator()
+        started = time.perf_counter()
+        await seed(args.users, channels, args.task_version)
+        print(f"Seed: {args.users} user, {args.channels} kanal - {time.perf_counter() - started:.1f} s")
+
+    bot_stub = StubBot(args.member_latency_ms / 1000)
+    user_ids = random.sample(range(args.users), min(args.flows, args.users))
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(user_index):
+        async with semaphore:
+            await run_flow(bot_stub, USER_ID_BASE + user_index, request_channels)
+
+    metrics.recent_interactions.clear()
+    tracemalloc.start()
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        await asyncio.gather(*(limited(i) for i in user_ids))
+        flows_elapsed = time.perf_counter() - started
+        await run_admin_views(args.admin_rounds)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    entries = list(metrics.recent_interactions)
+    flow_entries = [entry for entry in entries if not entry[1].startswith('admin_')]
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'users': args.users,
+            'channels': args.channels,
+            'request_channels': request_channels,
+            'flows': len(user_ids),
+            'concurrency': args.concurrency,
+            'member_latency_ms': args.member_latency_ms,
+        },
+        'flows_per_sec': round(len(user_ids) / flows_elapsed, 2),
+        'per_flow': {
+            'rpcs': round(sum(entry[3] for entry in flow_entries) / len(user_ids), 2),
+            'reads': round(sum(entry[4] for entry in flow_entries) / len(user_ids), 2),
+            'writes': round(sum(entry[5] for entry in flow_entries) / len(user_ids), 2),
+        },
+        'steps': summarize(entries),
+        'memory': {
+            'traced_peak_mb': round(peak / 2 ** 20, 2),
+            'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+        },
+    }
+
+
+def compare(old, new):
+    print(f"\n{'qadam':28} {'p50 ms':>16} {'p95 ms':>16} {'o`qish':>14}")
+    for name, step in new['steps'].items():
+        before = old.get('steps', {}).get(name)
+        if not before:
+            print(f"{name:28} {step['p50_ms']:>16} {step['p95_ms']:>16} {step['reads']:>14}")
+            continue
+        print(
+            f"{name:28} "
+            f"{before['p50_ms']:>7} -> {step['p50_ms']:<6} "
+            f"{before['p95_ms']:>7} -> {step['p95_ms']:<6} "
+            f"{before['reads']:>5} -> {step['reads']:<6}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000, help="seed qilinadigan userlar (1k-100k)")
+    parser.add_argument('--channels', type=int, default=5, help="kanallar soni (1-20)")
+    parser.add_argument('--flows', type=int, default=200, help="nechta user flow dan o'tadi")
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--admin-rounds', type=int, default=5)
+    parser.add_argument('--member-latency-ms', type=float, default=30.0, help="get_chat_member kechikishi")
+    parser.add_argument('--task-version', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-seed', action='store_true', help="emulatordagi mavjud ma'lumotdan foydalanish")
+    parser.add_argument('--out', help="natijani JSON faylga yozish")
+    parser.add_argument('--compare', help="oldingi JSON natija bilan solishtirish")
+    args = parser.parse_args()
+
+    result = asyncio.run(benchmark(args))
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
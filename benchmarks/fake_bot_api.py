@@ -0,0 +1,225 @@
+"""Telegram Bot API o'rnini bosuvchi lokal server (yuklama testlari uchun).
+
+    python benchmarks/fake_bot_api.py --port 8081 --latency-ms 20 --rate-429 0.01
+
+Bot TELEGRAM_API_URL=http://127.0.0.1:8081 bilan ishga tushiriladi. Qo'llab-quvvatlanadi:
+getMe, getUpdates (long polling), setWebhook/deleteWebhook (webhook ga yetkazish), getChatMember,
+sendMessage, editMessageText, answerCallbackQuery. Har bir metodga kechikish va 429 qo'shiladi.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import urllib.parse
+from collections import defaultdict, deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from webserver import start_http_server, text_response
+
+FAKE_BOT_USER = {'id': 1, 'is_bot': True, 'first_name': "Fake TDM Bot", 'username': "fake_tdm_bot"}
+API_METHODS = [
+    'getMe', 'getUpdates', 'setWebhook', 'deleteWebhook', 'getChatMember',
+    'sendMessage', 'editMessageText', 'answerCallbackQuery',
+]
+
+
+def _json(payload, status=200):
+    return text_response(json.dumps(payload), status, content_type="application/json")
+
+
+def _parse_params(request):
+    if 'json' in request.headers.get('content-type', ''):
+        return json.loads(request.body or b'{}')
+    params = {}
+    for key, values in urllib.parse.parse_qs(request.body.decode()).items():
+        value = values[0]
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+class FakeBotApi:
+    def __init__(self, token, latency_ms=0.0, rate_429=0.0, retry_after=1, member_status='member'):
+        self.token = token
+        self.latency = latency_ms / 1000
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.member_status = member_status
+
+        self.updates = deque()
+        self.update_id = 0
+        self.new_updates = asyncio.Event()
+        self.webhook = None
+        self.ready = asyncio.Event()
+
+        self.calls = defaultdict(int)
+        self.throttled = defaultdict(int)
+        self.errors = defaultdict(int)
+        # Javob kutayotgan update lar (chat_id -> update_id lar) va vaqtlari
+        self.pending = defaultdict(deque)
+        self.delivered_at = {}
+        self.injected_at = {}
+        # (tugagan vaqt, yetkazish kechikishi, to'liq kechikish)
+        self.completed = []
+        self._message_id = 0
+        self._deliveries = set()
+
+    # ---------- update larni kiritish ----------
+
+    def inject(self, payload, chat_id):
+        self.update_id += 1
+        update = dict(payload, update_id=self.update_id)
+        self.injected_at[self.update_id] = time.perf_counter()
+        self.pending[chat_id].append(self.update_id)
+        if self.webhook:
+            task = asyncio.get_running_loop().create_task(self._deliver_webhook(update))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+        else:
+            self.updates.append(update)
+            self.new_updates.set()
+        return self.update_id
+
+    async def _deliver_webhook(self, update):
+        url = urllib.parse.urlsplit(self.webhook['url'])
+        body = json.dumps(update).encode()
+        try:
+            reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+            writer.write(
+                f"POST {url.path or '/'} HTTP/1.1\r\n"
+                f"Host: {url.netloc}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"X-Telegram-Bot-Api-Secret-Token: {self.webhook.get('secret_token', '')}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+            self.delivered_at[update['update_id']] = time.perf_counter()
+            status_line = await reader.readline()
+            if b' 200 ' not in status_line:
+                self.errors['webhook_rejected'] += 1
+            writer.close()
+        except OSError:
+            self.errors['webhook_failed'] += 1
+
+    def _complete(self, chat_id):
+        """Bot shu chatga ko'rinadigan javob yubordi - eng eski kutayotgan update tugadi"""
+        queue = self.pending.get(chat_id)
+        if not queue:
+            return
+        update_id = queue.popleft()
+        now = time.perf_counter()
+        injected = self.injected_at.pop(update_id)
+        delivered = self.delivered_at.pop(update_id, injected)
+        self.completed.append((now, delivered - injected, now - injected))
+
+    # ---------- Bot API metodlari ----------
+
+    def _message(self, chat_id, text):
+        self._message_id += 1
+        return {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': FAKE_BOT_USER,
+            'text': text,
+        }
+
+    async def call(self, method, params):
+        self.calls[method] += 1
+        if method != 'getUpdates':
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.rate_429 and method not in ('getMe', 'setWebhook', 'deleteWebhook') \
+                    and random.random() < self.rate_429:
+                self.throttled[method] += 1
+                return _json({
+                    'ok': False, 'error_code': 429,
+                    'description': f"Too Many Requests: retry after {self.retry_after}",
+                    'parameters': {'retry_after': self.retry_after},
+                }, 429)
+
+        if method == 'getMe':
+            result = FAKE_BOT_USER
+        elif method == 'getUpdates':
+            result = await self._get_updates(params)
+        elif method == 'setWebhook':
+            self.webhook = params
+            self.ready.set()
+            result = True
+        elif method == 'deleteWebhook':
+            self.webhook = None
+            result = True
+        elif method == 'getChatMember':
+            result = {
+                'status': self.member_status,
+                'user': {'id': int(params['user_id']), 'is_bot': False, 'first_name': "User"},
+            }
+        elif method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params.get('chat_id', 0))
+            self._complete(chat_id)
+            result = self._message(chat_id, params.get('text', ''))
+        else:
+            result = True
+        return _json({'ok': True, 'result': result})
+
+    async def _get_updates(self, params):
+        self.ready.set()
+        offset = int(params.get('offset') or 0)
+        while self.updates and self.updates[0]['update_id'] < offset:
+            self.updates.popleft()
+        if not self.updates:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                return []
+        batch = list(self.updates)[:int(params.get('limit') or 100)]
+        now = time.perf_counter()
+        for update in batch:
+            self.delivered_at.setdefault(update['update_id'], now)
+        return batch
+
+    def close(self):
+        """Kutib turgan getUpdates so'rovlarini bo'shatish"""
+        self.new_updates.set()
+
+    def routes(self):
+        routes = {}
+        for method in API_METHODS:
+            async def handle(request, method=method):
+                return await self.call(method, _parse_params(request))
+            for http_method in ('GET', 'POST'):
+                routes[(http_method, f"/bot{self.token}/{method}")] = handle
+        return routes
+
+    async def start(self, port, host="127.0.0.1"):
+        return await start_http_server(self.routes(), port, host)
+
+
+async def serve(args):
+    api = FakeBotApi(args.token, args.latency_ms, args.rate_429, args.retry_after)
+    server = await api.start(args.port)
+    print(f"Fake Bot API: http://127.0.0.1:{args.port}  (token {args.token})")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--token', default="123456:FAKE")
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0, help="429 qaytarish ehtimoli (0-1)")
+    parser.add_argument('--retry-after', type=int, default=1)
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Haqiqiy bot.py (main() dagi Application) ni soxta Bot API orqali yuklama bilan sinash.
+
+    gcloud emulators firestore start --host-port=localhost:8080
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python benchmarks/load_test.py --rate 1000 --duration 30
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python benchmarks/load_test.py --mode webhook --rate-429 0.02
+
+bot.py alohida jarayonda TELEGRAM_API_URL bilan ishga tushadi; update lar getUpdates yoki webhook
+orqali yetkaziladi. Hisobot: updates/sec, navbat (yetkazish) kechikishi, to'liq javob kechikishi,
+javobsiz qolganlar, 429 va metodlar bo'yicha API chaqiruvlar - JSON.
+"""
+import os
+import sys
+import json
+import time
+import random
+import secrets
+import signal
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotApi
+from metrics import percentile
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot.py')
+USER_ID_BASE = 20_000_000
+
+
+def parse_mix(text):
+    """'start=4,check_subs=3,mark_requested=3' -> ([turlar], [og'irliklar])"""
+    kinds, weights = [], []
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        kinds.append(kind.strip())
+        weights.append(float(weight or 1))
+    return kinds, weights
+
+
+def make_update(kind, user_id, seq):
+    user = {'id': user_id, 'is_bot': False, 'first_name': f"load{user_id}"}
+    chat = {'id': user_id, 'type': 'private'}
+    if kind == 'start':
+        return {'message': {
+            'message_id': seq, 'date': int(time.time()), 'chat': chat, 'from': user,
+            'text': '/start', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        }}
+    return {'callback_query': {
+        'id': str(seq), 'from': user, 'chat_instance': str(user_id), 'data': kind,
+        'message': {'message_id': 1, 'date': int(time.time()), 'chat': chat, 'text': "tasks"},
+    }}
+
+
+async def generate(api, args):
+    kinds, weights = parse_mix(args.mix)
+    total = int(args.rate * args.duration)
+    started = time.perf_counter()
+    for seq in range(total):
+        # Jadval bo'yicha: seq-update started + seq/rate da yuboriladi
+        delay = started + seq / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        user_id = USER_ID_BASE + random.randrange(args.users)
+        kind = random.choices(kinds, weights)[0]
+        api.inject(make_update(kind, user_id, seq), user_id)
+    return total, time.perf_counter() - started
+
+
+async def run(args):
+    random.seed(args.seed)
+    api = FakeBotApi(args.token, args.latency_ms, args.rate_429, args.retry_after)
+    server = await api.start(args.api_port)
+
+    env = dict(
+        os.environ,
+        BOT_TOKEN=args.token,
+        TELEGRAM_API_URL=f"http://127.0.0.1:{args.api_port}",
+        PORT=str(args.bot_port),
+    )
+    env.pop('WEBHOOK_URL', None)
+    env.setdefault('PROMO_CODE_KEY', secrets.token_hex(32))
+    if args.mode == 'webhook':
+        env['WEBHOOK_URL'] = f"http://127.0.0.1:{args.bot_port}"
+    log = open(args.bot_log, 'w') if args.bot_log else asyncio.subprocess.DEVNULL
+    bot_process = await asyncio.create_subprocess_exec(
+        sys.executable, BOT_PATH, env=env, stdout=log, stderr=asyncio.subprocess.STDOUT
+    )
+
+    try:
+        await asyncio.wait_for(api.ready.wait(), args.startup_timeout)
+        print(f"Bot tayyor ({args.mode}), yuklama: {args.rate}/s x {args.duration} s")
+
+        injected, send_elapsed = await generate(api, args)
+        drain_deadline = time.perf_counter() + args.drain
+        while len(api.completed) < injected and time.perf_counter() < drain_deadline:
+            await asyncio.sleep(0.1)
+    finally:
+        if bot_process.returncode is None:
+            bot_process.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(bot_process.wait(), 10)
+            except asyncio.TimeoutError:
+                bot_process.kill()
+        api.close()
+        server.close()
+        await asyncio.sleep(0.1)
+
+    completed = api.completed
+    delivery = sorted(entry[1] for entry in completed)
+    latency = sorted(entry[2] for entry in completed)
+    window = (completed[-1][0] - completed[0][0]) if len(completed) > 1 else 0
+    return {
+        'config': {
+            'mode': args.mode,
+            'rate': args.rate,
+            'duration': args.duration,
+            'users': args.users,
+            'mix': args.mix,
+            'api_latency_ms': args.latency_ms,
+            'rate_429': args.rate_429,
+        },
+        'injected': injected,
+        'injected_per_sec': round(injected / send_elapsed, 1),
+        'completed': len(completed),
+        'unanswered': injected - len(completed),
+        'updates_per_sec': round(len(completed) / window, 1) if window else None,
+        'queue_delay_ms': {
+            'p50': round(percentile(delivery, 0.50) * 1000, 1),
+            'p95': round(percentile(delivery, 0.95) * 1000, 1),
+            'p99': round(percentile(delivery, 0.99) * 1000, 1),
+        },
+        'latency_ms': {
+            'p50': round(percentile(latency, 0.50) * 1000, 1),
+            'p95': round(percentile(latency, 0.95) * 1000, 1),
+            'p99': round(percentile(latency, 0.99) * 1000, 1),
+        },
+        'error_rate': round((injected - len(completed)) / injected, 4) if injected else 0,
+        'api_calls': dict(api.calls),
+        'throttled_429': dict(api.throttled),
+        'errors': dict(api.errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default='polling')
+    parser.add_argument('--rate', type=float, default=500, help="update/soniya")
+    parser.add_argument('--duration', type=float, default=20, help="soniya")
+    parser.add_argument('--users', type=int, default=5000, help="turli userlar soni")
+    parser.add_argument('--mix', default="start=4,check_subs=3,mark_requested=3")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="har bir Bot API javobiga kechikish")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="429 ehtimoli (0-1)")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--drain', type=float, default=30.0, help="yuklamadan keyin javoblarni kutish (s)")
+    parser.add_argument('--startup-timeout', type=float, default=60.0)
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--bot-port', type=int, default=8090)
+    parser.add_argument('--token', default="123456:FAKE")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--bot-log', help="bot.py chiqishini shu faylga yozish")
+    parser.add_argument('--out', help="natijani JSON faylga yozish")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
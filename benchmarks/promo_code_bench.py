@@ -0,0 +1,98 @@
+"""Promo kod generatorlarini solishtirish va takrorlanmaslikni tekshirish.
+
+    python benchmarks/promo_code_bench.py --count 200000 --existing 100000 --rtt-ms 40
+    python benchmarks/promo_code_bench.py --verify 5000000
+
+Eski usul: tasodifiy kod + har bir nomzod uchun promo_codes dan get() (bu yerda set bilan simulyatsiya).
+Yangi usul: blok qilib band qilingan ketma-ket raqam + kalitli almashtirish (o'qishsiz).
+"""
+import os
+import sys
+import time
+import json
+import secrets
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from promo_codes import PROMO_CODE_CHARS, PROMO_CODE_LENGTH, random_promo_code, promo_code_for
+
+
+def bench_random_loop(count, existing):
+    """generate_promo_code ning eski sikli: har bir nomzod = 1 ta Firestore o'qish"""
+    taken = set(existing)
+    reads = 0
+    started = time.perf_counter()
+    for _ in range(count):
+        while True:
+            code = random_promo_code()
+            reads += 1
+            if code not in taken:
+                taken.add(code)
+                break
+    elapsed = time.perf_counter() - started
+    return {'codes': count, 'seconds': elapsed, 'reads': reads, 'writes': count}
+
+
+def bench_sequence(count, block_size):
+    """Ketma-ket raqamlar: har bir blok uchun 1 ta tranzaksiya (1 o'qish + 1 yozish)"""
+    key = secrets.token_bytes(32)
+    started = time.perf_counter()
+    for number in range(count):
+        promo_code_for(number, key)
+    elapsed = time.perf_counter() - started
+    blocks = -(-count // block_size)
+    return {'codes': count, 'seconds': elapsed, 'reads': blocks, 'writes': count + blocks}
+
+
+def verify_unique(count):
+    """count ta ketma-ket raqam count ta turli, to'g'ri formatdagi kodga o'tishini tekshirish"""
+    key = secrets.token_bytes(32)
+    allowed = set(PROMO_CODE_CHARS)
+    seen = set()
+    started = time.perf_counter()
+    for number in range(count):
+        code = promo_code_for(number, key)
+        assert len(code) == PROMO_CODE_LENGTH and set(code) <= allowed, code
+        seen.add(code)
+    assert len(seen) == count, f"Takrorlangan kodlar: {count - len(seen)}"
+    return {'codes': count, 'unique': len(seen), 'seconds': time.perf_counter() - started}
+
+
+def summarize(name, result, rtt_ms):
+    per_code_reads = result['reads'] / result['codes']
+    # Eski usulda o'qishlar ketma-ket: har bir kod kamida (o'qishlar + 1 yozish) * RTT kutadi
+    modelled_ms = (per_code_reads + result['writes'] / result['codes']) * rtt_ms
+    return {
+        'generator': name,
+        'codes': result['codes'],
+        'codes_per_sec_cpu': round(result['codes'] / result['seconds']),
+        'reads_per_code': round(per_code_reads, 4),
+        'writes_per_code': round(result['writes'] / result['codes'], 4),
+        'modelled_latency_ms_per_code': round(modelled_ms, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100000, help="nechta kod yaratiladi")
+    parser.add_argument('--existing', type=int, default=0, help="bazada oldindan bor kodlar soni")
+    parser.add_argument('--block-size', type=int, default=1000)
+    parser.add_argument('--rtt-ms', type=float, default=40.0, help="Firestore bitta so'rov vaqti (model)")
+    parser.add_argument('--verify', type=int, default=0, help="takrorlanmaslikni shuncha kodda tekshirish")
+    args = parser.parse_args()
+
+    if args.verify:
+        print(json.dumps(verify_unique(args.verify), indent=2))
+        return
+
+    existing = {random_promo_code() for _ in range(args.existing)}
+    results = [
+        summarize('random_loop', bench_random_loop(args.count, existing), args.rtt_ms),
+        summarize('sequence_permutation', bench_sequence(args.count, args.block_size), args.rtt_ms),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
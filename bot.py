@@ -1,34 +1,34 @@
+import time
+# Cold start vaqti shu nuqtadan o'lchanadi
+BOOT_STARTED = time.perf_counter()
+
+import io
 import os
 import json
-import string
-import random
-import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from datetime import datetime
+import hmac
+import signal
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
-import firebase_admin
-from firebase_admin import credentials, firestore
-
-
-# ============================================================
-# HEALTH CHECK SERVER (Koyeb/Render uchun)
-# ============================================================
-
-class HealthHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(b"OK")
-
-    def log_message(self, format, *args):
-        pass
-
-def start_health_server():
-    port = int(os.getenv("PORT", 8000))
-    server = HTTPServer(("0.0.0.0", port), HealthHandler)
-    server.serve_forever()
+from telegram.ext import Application, SimpleUpdateProcessor, CommandHandler, CallbackQueryHandler, ChatMemberHandler, ContextTypes, MessageHandler, filters
+from webserver import start_http_server, text_response
+from metrics import instrumented, render_metrics, perf_summary, InstrumentedRequest
+from profiler import profile_event_loop, PROFILE_MAX_SECONDS
+from broadcast import run_broadcast_job, resume_broadcast_jobs, broadcast_resume_worker
+from export import EXPORT_COLLECTIONS, EXPORT_ALIASES, parse_export_args, run_export
+from promo_api import PROMO_API_KEY, promo_api_routes, audit_worker, flush_audit
+from repository import (
+    start_config_listener, warm_up,
+    get_channels, save_channels, get_task_version, set_task_version, get_promo_coins, set_promo_coins,
+    save_user_request, get_user_progress, backfill_user_progress,
+    count_user_requests, get_request_totals, get_request_counts,
+    get_bot_user, get_recent_users_page, ensure_bot_user, create_broadcast_job,
+    BROADCAST_SEGMENTS, count_segment, sync_unused_code_flags,
+    get_codes_page, get_codes_for_user, count_documents,
+    CODE_POOL_TARGET, issue_reward, refill_code_pool, get_code_pool_depth, code_pool_worker, code_pool_stats,
+)
 
 
 # .env fayldan o'qish
@@ -39,60 +39,40 @@ load_dotenv()
 # ============================================================
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
+# Yuklama testlarida lokal soxta Bot API server (benchmarks/fake_bot_api.py) ko'rsatiladi
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip('/')
 
 ADMIN_IDS = [6768934631]
 
-PROMO_COIN_AMOUNT = 20
+# Bir vaqtda nechta update ishlanadi (bitta userniki baribir ketma-ket)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", 64))
 
+# Health check va webhook shu portda (Koyeb/Render)
+PORT = int(os.getenv("PORT", 8000))
 
-# ============================================================
-# FIREBASE INIT
-# ============================================================
+# WEBHOOK_URL berilsa (masalan https://tdm-bot.koyeb.app) webhook rejimi, aks holda polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip('/')
+WEBHOOK_PATH = "/telegram"
+# Barcha instanslarda bir xil bo'lishi kerak, shuning uchun tokendan hosil qilinadi
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()
 
-firebase_creds_json = os.getenv("FIREBASE_CREDENTIALS")
-if firebase_creds_json:
-    cred_dict = json.loads(firebase_creds_json)
-    cred = credentials.Certificate(cred_dict)
-else:
-    cred = credentials.Certificate("service_account.json")
+# bot_config/settings da promo_coins bo'lmasa ishlatiladi
+PROMO_COIN_AMOUNT = 20
 
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# Obunani tekshirish: bir vaqtda nechta get_chat_member va har biriga timeout (soniya)
+MEMBER_CHECK_CONCURRENCY = int(os.getenv("MEMBER_CHECK_CONCURRENCY", 5))
+MEMBER_CHECK_TIMEOUT = float(os.getenv("MEMBER_CHECK_TIMEOUT", 5))
+
+# A'zolik keshi: obuna bo'lganlar uzoqroq, obuna bo'lmaganlar qisqa saqlanadi (soniya)
+MEMBER_CACHE_TTL = int(os.getenv("MEMBER_CACHE_TTL", 120))
+MEMBER_CACHE_NEGATIVE_TTL = int(os.getenv("MEMBER_CACHE_NEGATIVE_TTL", 10))
+MEMBER_CACHE_MAX_SIZE = 50000
 
 
 # ============================================================
 # YORDAMCHI FUNKSIYALAR
 # ============================================================
 
-def generate_promo_code(length=8):
-    chars = string.ascii_uppercase + string.digits
-    while True:
-        code = ''.join(random.choices(chars, k=length))
-        doc = db.collection('promo_codes').document(code).get()
-        if not doc.exists:
-            return code
-
-
-def get_channels():
-    try:
-        doc = db.collection('bot_config').document('channels').get()
-        if doc.exists:
-            return doc.to_dict().get('list', [])
-    except Exception as e:
-        print(f"Kanallarni olishda xato: {e}")
-    return []
-
-
-def get_task_version():
-    try:
-        doc = db.collection('bot_config').document('settings').get()
-        if doc.exists:
-            return doc.to_dict().get('task_version', 1)
-    except Exception as e:
-        print(f"Versiya olishda xato: {e}")
-    return 1
-
-
 def is_admin(user_id):
     return user_id in ADMIN_IDS
 
@@ -119,48 +99,158 @@ def fix_url(url):
     return url
 
 
-def save_user_request(user_id, channel_id, task_version):
-    """Userning so'rov yuborgan kanalini saqlash"""
-    try:
-        db.collection('user_requests').document(f"{user_id}_{channel_id}_{task_version}").set({
-            'user_id': str(user_id),
-            'channel_id': channel_id,
-            'task_version': task_version,
-            'requested_at': firestore.SERVER_TIMESTAMP,
-        })
-        return True
-    except Exception as e:
-        print(f"So'rovni saqlashda xato: {e}")
-        return False
+# ============================================================
+# OBUNANI TEKSHIRISH
+# ============================================================
 
+# (kanal_id, user_id) -> (status, amal qilish muddati)
+_member_cache = {}
+
+
+def remember_membership(chat_id, user_id, status):
+    ttl = MEMBER_CACHE_TTL if status == 'ok' else MEMBER_CACHE_NEGATIVE_TTL
+    now = time.monotonic()
+    if len(_member_cache) >= MEMBER_CACHE_MAX_SIZE:
+        for key in [k for k, (_, expires) in _member_cache.items() if expires <= now]:
+            del _member_cache[key]
+        if len(_member_cache) >= MEMBER_CACHE_MAX_SIZE:
+            _member_cache.clear()
+    _member_cache[(str(chat_id), user_id)] = (status, now + ttl)
+
+
+def cached_membership(chat_id, user_id):
+    entry = _member_cache.get((str(chat_id), user_id))
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+    return None
 
-def check_user_request(user_id, channel_id, task_version):
-    """User oldin so'rov yuborgan yoki yubormaganligini tekshirish"""
-    try:
-        doc = db.collection('user_requests').document(f"{user_id}_{channel_id}_{task_version}").get()
-        return doc.exists
-    except Exception as e:
-        print(f"So'rovni tekshirishda xato: {e}")
-        return False
 
+async def check_memberships(bot, channels, user_id):
+    """Kanallar a'zoligini parallel tekshirish: {kanal_id: 'ok' | 'left' | 'timeout' | 'error'}"""
+    semaphore = asyncio.Semaphore(MEMBER_CHECK_CONCURRENCY)
 
-def get_user_remaining_requests(user_id, task_version):
-    """Userning qaysi kanallarga so'rov yuborishi kerakligini aniqlash"""
-    channels = get_channels()
+    async def check(ch):
+        cached = cached_membership(ch['id'], user_id)
+        if cached:
+            return cached
+        async with semaphore:
+            try:
+                member = await asyncio.wait_for(
+                    bot.get_chat_member(ch['id'], user_id), MEMBER_CHECK_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                print(f"Kanal tekshirishda timeout ({ch['id']})")
+                return 'timeout'
+            except Exception as e:
+                print(f"Kanal tekshirishda xato ({ch['id']}): {e}")
+                return 'error'
+        status = 'left' if member.status in ['left', 'kicked'] else 'ok'
+        remember_membership(ch['id'], user_id, status)
+        return status
+
+    results = await asyncio.gather(*(check(ch) for ch in channels))
+    return {ch['id']: result for ch, result in zip(channels, results)}
+
+
+@instrumented
+async def track_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Bot admin bo'lgan kanallardagi a'zolik o'zgarishlari bilan keshni yangilash"""
+    change = update.chat_member
+    if not change:
+        return
+
+    member = change.new_chat_member
+    status = 'left' if member.status in ['left', 'kicked'] else 'ok'
+    # Kanallar sozlamada ham -100..., ham @username ko'rinishida saqlanishi mumkin
+    remember_membership(change.chat.id, member.user.id, status)
+    if change.chat.username:
+        remember_membership(f"@{change.chat.username}", member.user.id, status)
+
+
+# ============================================================
+# VAZIFALAR EKRANI
+# ============================================================
+
+# Ekranning statik qismi (URL tekshiruvi, tugmalar, matn) sozlamalar o'zgarguncha bir marta quriladi
+_task_screen = {'key': None, 'screen': None}
+
+MARK_REQUESTED_ROW = (InlineKeyboardButton("📤 So'rov yubordim", callback_data="mark_requested"),)
+CHECK_SUBS_ROW = (InlineKeyboardButton("✅ Bajarildi, tekshiring!", callback_data="check_subs"),)
+
+
+def build_task_screen(channels, coins):
+    regular_channels = [ch for ch in channels if ch.get('type') in ['channel', 'link', None]]
     request_channels = [ch for ch in channels if ch.get('type') == 'request']
-    
-    remaining = []
-    for ch in request_channels:
-        if not check_user_request(user_id, ch['id'], task_version):
-            remaining.append(ch)
-    
-    return remaining
+
+    body = ""
+    regular_rows = []
+    if regular_channels:
+        body += "1️⃣ Quyidagi kanallarga obuna bo'ling:\n\n"
+        for ch in regular_channels:
+            url = ch.get('url', '')
+            if not is_valid_url(url):
+                print(f"[TASKS] Noto'g'ri URL o'tkazib yuborildi: {url}")
+                continue
+            regular_rows.append((InlineKeyboardButton(f"📱 {ch['name']}", url=fix_url(url)),))
+
+    # (kanal_id, so'rov yuborilgan qator, yuborilmagan qator)
+    request_rows = []
+    if request_channels:
+        body += "\n2️⃣ Quyidagi yopiq kanallarga so'rov yuboring:\n\n"
+        for ch in request_channels:
+            url = ch.get('url', '')
+            if not is_valid_url(url):
+                continue
+            url = fix_url(url)
+            request_rows.append((
+                ch['id'],
+                (InlineKeyboardButton(f"✅ {ch['name']} (So'rov yuborildi)", url=url),),
+                (InlineKeyboardButton(f"🔐 {ch['name']} (So'rov yuboring)", url=url),),
+            ))
+
+    return {
+        'body': body + f"\n\n💰 Mukofot: {coins} coin",
+        'regular_rows': regular_rows,
+        'request_rows': request_rows,
+        'request_channels': request_channels,
+        'member_channels': [ch for ch in channels if ch.get('type', 'channel') not in ['link', 'request']],
+    }
+
+
+def get_task_screen(channels, task_version, coins):
+    """Tayyor ekran; kanallar, versiya yoki coin o'zgarsa qayta quriladi"""
+    key = (task_version, coins, tuple(
+        (ch.get('id'), ch.get('name'), ch.get('url'), ch.get('type')) for ch in channels
+    ))
+    if _task_screen['key'] != key:
+        _task_screen.update(key=key, screen=build_task_screen(channels, coins))
+    return _task_screen['screen']
+
+
+def task_screen_text(screen, title, requested):
+    remaining = sum(1 for ch in screen['request_channels'] if ch['id'] not in requested)
+    text = title + screen['body']
+    if remaining:
+        text += f"\n\n⚠️ Hali {remaining} ta yopiq kanalga so'rov yuborishingiz kerak!"
+    elif screen['request_channels']:
+        text += "\n\n✅ Barcha yopiq kanallarga so'rov yuborildi!"
+    return text
+
+
+def task_screen_keyboard(screen, requested):
+    keyboard = list(screen['regular_rows'])
+    keyboard += [done if ch_id in requested else todo for ch_id, done, todo in screen['request_rows']]
+    if any(ch['id'] not in requested for ch in screen['request_channels']):
+        keyboard.append(MARK_REQUESTED_ROW)
+    keyboard.append(CHECK_SUBS_ROW)
+    return InlineKeyboardMarkup(keyboard)
 
 
 # ============================================================
 # USER HANDLERLARI
 # ============================================================
 
+@instrumented
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.effective_user
@@ -184,21 +274,26 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Oddiy userga vazifalarni ko'rsatish"""
     user = update.effective_user
-    channels = get_channels()
-    task_version = get_task_version()
+    channels = await get_channels()
+    task_version = await get_task_version()
+    coins = await get_promo_coins(PROMO_COIN_AMOUNT)
 
     print(f"[TASKS] User: {user.id}, Channels: {len(channels)}, Version: {task_version}")
 
+    # User hujjati va so'rovlar holati - bitta o'qishda
+    data, requested = await get_user_progress(user.id, task_version, channels)
+    if data is None:
+        # Broadcast segmentlari uchun har bir user bot_users da bo'lishi kerak
+        await ensure_bot_user(user)
+
     # Foydalanuvchi allaqachon bajarganmi tekshirish
     try:
-        user_doc = db.collection('bot_users').document(str(user.id)).get()
-        if user_doc.exists:
-            data = user_doc.to_dict()
+        if data:
             if data.get('completed_version') == task_version:
                 await update.message.reply_text(
                     f"✅ Siz barcha vazifalarni bajargansiz!\n\n"
                     f"🎁 Promo kodingiz: `{data.get('last_code', 'N/A')}`\n\n"
-                    f"Bu kodni TDM Training ilovasiga kiriting va {PROMO_COIN_AMOUNT} coin oling!",
+                    f"Bu kodni TDM Training ilovasiga kiriting va {coins} coin oling!",
                     parse_mode='Markdown'
                 )
                 return
@@ -211,66 +306,31 @@ async def show_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # Kanallarni turlarga ajratish
-    regular_channels = [ch for ch in channels if ch.get('type') in ['channel', 'link', None]]
-    request_channels = [ch for ch in channels if ch.get('type') == 'request']
-    
-    # So'rov yuborilmagan kanallarni topish
-    remaining_requests = get_user_remaining_requests(user.id, task_version)
-
-    text = "📢 Vazifalarni bajaring va mukofot oling!\n\n"
-    
-    keyboard = []
-    
-    # Oddiy kanallar va havolalar
-    if regular_channels:
-        text += "1️⃣ Quyidagi kanallarga obuna bo'ling:\n\n"
-        for ch in regular_channels:
-            url = ch.get('url', '')
-            if not is_valid_url(url):
-                print(f"[TASKS] Noto'g'ri URL o'tkazib yuborildi: {url}")
-                continue
-            url = fix_url(url)
-            keyboard.append([InlineKeyboardButton(f"📱 {ch['name']}", url=url)])
-    
-    # So'rov yuborish kerak bo'lgan kanallar
-    if request_channels:
-        text += "\n2️⃣ Quyidagi yopiq kanallarga so'rov yuboring:\n\n"
-        for ch in request_channels:
-            url = ch.get('url', '')
-            if not is_valid_url(url):
-                continue
-            url = fix_url(url)
-            
-            # Agar user so'rov yuborgan bo'lsa, belgi qo'shish
-            if check_user_request(user.id, ch['id'], task_version):
-                keyboard.append([InlineKeyboardButton(f"✅ {ch['name']} (So'rov yuborildi)", url=url)])
-            else:
-                keyboard.append([InlineKeyboardButton(f"🔐 {ch['name']} (So'rov yuboring)", url=url)])
-
-    text += f"\n\n💰 Mukofot: {PROMO_COIN_AMOUNT} coin"
-    
-    # So'rov yuborish tugmasi
-    if remaining_requests:
-        text += f"\n\n⚠️ Hali {len(remaining_requests)} ta yopiq kanalga so'rov yuborishingiz kerak!"
-        keyboard.append([InlineKeyboardButton("📤 So'rov yubordim", callback_data="mark_requested")])
-    
-    # Tekshirish tugmasi
-    keyboard.append([InlineKeyboardButton("✅ Bajarildi, tekshiring!", callback_data="check_subs")])
-
-    await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    screen = get_task_screen(channels, task_version, coins)
+    await update.message.reply_text(
+        task_screen_text(screen, "📢 Vazifalarni bajaring va mukofot oling!\n\n", requested),
+        reply_markup=task_screen_keyboard(screen, requested)
+    )
 
 
+@instrumented
 async def mark_requested(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """User so'rov yubordi deb belgilash"""
     query = update.callback_query
     await query.answer()
 
     user = query.from_user
-    task_version = get_task_version()
+    task_version = await get_task_version()
+    coins = await get_promo_coins(PROMO_COIN_AMOUNT)
+    
+    channels = await get_channels()
+    screen = get_task_screen(channels, task_version, coins)
     
     # So'rov yuborilmagan kanallarni topish
-    remaining_requests = get_user_remaining_requests(user.id, task_version)
+    data, requested = await get_user_progress(user.id, task_version, channels)
+    if data is None:
+        await ensure_bot_user(user)
+    remaining_requests = [ch for ch in screen['request_channels'] if ch['id'] not in requested]
     
     if not remaining_requests:
         await query.message.reply_text(
@@ -281,70 +341,31 @@ async def mark_requested(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Birinchi so'rov yuborilmagan kanalga belgilash
     first_channel = remaining_requests[0]
-    save_user_request(user.id, first_channel['id'], task_version)
-    
-    # Qayta vazifalarni ko'rsatish
-    channels = get_channels()
-    request_channels = [ch for ch in channels if ch.get('type') == 'request']
-    regular_channels = [ch for ch in channels if ch.get('type') in ['channel', 'link', None]]
-    
-    # Qolgan so'rovlarni hisoblash
-    new_remaining = get_user_remaining_requests(user.id, task_version)
-    
-    text = f"✅ So'rov qabul qilindi!\n\n"
-    
-    keyboard = []
+    if await save_user_request(user.id, first_channel['id'], task_version, new_user=data is None):
+        requested.add(first_channel['id'])
     
-    # Oddiy kanallar
-    if regular_channels:
-        text += "1️⃣ Quyidagi kanallarga obuna bo'ling:\n\n"
-        for ch in regular_channels:
-            url = ch.get('url', '')
-            if not is_valid_url(url):
-                continue
-            url = fix_url(url)
-            keyboard.append([InlineKeyboardButton(f"📱 {ch['name']}", url=url)])
-    
-    # Yopiq kanallar
-    if request_channels:
-        text += "\n2️⃣ Yopiq kanallar:\n\n"
-        for ch in request_channels:
-            url = ch.get('url', '')
-            if not is_valid_url(url):
-                continue
-            url = fix_url(url)
-            
-            if check_user_request(user.id, ch['id'], task_version):
-                keyboard.append([InlineKeyboardButton(f"✅ {ch['name']} (So'rov yuborildi)", url=url)])
-            else:
-                keyboard.append([InlineKeyboardButton(f"🔐 {ch['name']} (So'rov yuboring)", url=url)])
-    
-    text += f"\n\n💰 Mukofot: {PROMO_COIN_AMOUNT} coin"
-    
-    if new_remaining:
-        text += f"\n\n⚠️ Hali {len(new_remaining)} ta yopiq kanalga so'rov yuborishingiz kerak!"
-        keyboard.append([InlineKeyboardButton("📤 So'rov yubordim", callback_data="mark_requested")])
-    else:
-        text += "\n\n✅ Barcha yopiq kanallarga so'rov yuborildi!"
-    
-    keyboard.append([InlineKeyboardButton("✅ Bajarildi, tekshiring!", callback_data="check_subs")])
-    
-    await query.message.edit_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    await query.message.edit_text(
+        task_screen_text(screen, "✅ So'rov qabul qilindi!\n\n", requested),
+        reply_markup=task_screen_keyboard(screen, requested)
+    )
 
 
+@instrumented
 async def check_subscriptions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     user = query.from_user
-    channels = get_channels()
-    task_version = get_task_version()
+    channels = await get_channels()
+    task_version = await get_task_version()
+    coins = await get_promo_coins(PROMO_COIN_AMOUNT)
+
+    data, requested = await get_user_progress(user.id, task_version, channels)
 
     # Allaqachon bajarganmi
     try:
-        user_doc = db.collection('bot_users').document(str(user.id)).get()
-        if user_doc.exists and user_doc.to_dict().get('completed_version') == task_version:
-            code = user_doc.to_dict().get('last_code')
+        if data and data.get('completed_version') == task_version:
+            code = data.get('last_code')
             await query.message.reply_text(
                 f"✅ Siz allaqachon bajargansiz!\n\n"
                 f"🎁 Promo kodingiz: `{code}`\n\n"
@@ -359,9 +380,14 @@ async def check_subscriptions(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.message.reply_text("⏳ Hozircha vazifalar yo'q.")
         return
 
+    screen = get_task_screen(channels, task_version, coins)
+
+    # Channel turidagi kanallarni parallel tekshirish
+    memberships = await check_memberships(context.bot, screen['member_channels'], user.id)
+
     not_completed = []
     
-    # Oddiy kanallarni tekshirish
+    # Natijalarni kanallar tartibida yig'ish
     for ch in channels:
         ch_type = ch.get('type', 'channel')
         
@@ -371,17 +397,15 @@ async def check_subscriptions(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         # Request turidagi kanallar uchun - faqat so'rov yuborgan yoki yubormaganini tekshirish
         if ch_type == 'request':
-            if not check_user_request(user.id, ch['id'], task_version):
+            if ch['id'] not in requested:
                 not_completed.append(f"🔐 {ch['name']} (So'rov yuborishingiz kerak)")
             continue
         
-        # Channel turidagi oddiy kanallarni tekshirish
-        try:
-            member = await context.bot.get_chat_member(ch['id'], user.id)
-            if member.status in ['left', 'kicked']:
-                not_completed.append(f"📱 {ch['name']}")
-        except Exception as e:
-            print(f"Kanal tekshirishda xato ({ch['id']}): {e}")
+        # Channel turidagi oddiy kanallar
+        status = memberships[ch['id']]
+        if status == 'timeout':
+            not_completed.append(f"📱 {ch['name']} (Tekshirib bo'lmadi, qayta urinib ko'ring)")
+        elif status != 'ok':
             not_completed.append(f"📱 {ch['name']}")
 
     if not_completed:
@@ -390,70 +414,18 @@ async def check_subscriptions(update: Update, context: ContextTypes.DEFAULT_TYPE
         for item in not_completed:
             text += f"• {item}\n"
         
-        keyboard = []
-        
-        # Oddiy kanallar
-        regular_channels = [ch for ch in channels if ch.get('type') in ['channel', 'link', None]]
-        if regular_channels:
-            for ch in regular_channels:
-                url = ch.get('url', '')
-                if not is_valid_url(url):
-                    continue
-                url = fix_url(url)
-                keyboard.append([InlineKeyboardButton(f"📱 {ch['name']}", url=url)])
-        
-        # Yopiq kanallar
-        request_channels = [ch for ch in channels if ch.get('type') == 'request']
-        if request_channels:
-            for ch in request_channels:
-                url = ch.get('url', '')
-                if not is_valid_url(url):
-                    continue
-                url = fix_url(url)
-                
-                if check_user_request(user.id, ch['id'], task_version):
-                    keyboard.append([InlineKeyboardButton(f"✅ {ch['name']} (So'rov yuborildi)", url=url)])
-                else:
-                    keyboard.append([InlineKeyboardButton(f"🔐 {ch['name']} (So'rov yuboring)", url=url)])
-        
-        # So'rov yuborish tugmasi
-        remaining_requests = get_user_remaining_requests(user.id, task_version)
-        if remaining_requests:
-            keyboard.append([InlineKeyboardButton("📤 So'rov yubordim", callback_data="mark_requested")])
-        
-        keyboard.append([InlineKeyboardButton("✅ Bajarildi, tekshiring!", callback_data="check_subs")])
-        
-        await query.message.edit_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.message.edit_text(text, reply_markup=task_screen_keyboard(screen, requested))
         return
 
     # Hammasi OK - promo kod berish
     try:
-        code = generate_promo_code()
-
-        db.collection('promo_codes').document(code).set({
-            'code': code,
-            'telegram_uid': str(user.id),
-            'telegram_name': user.full_name,
-            'used': False,
-            'used_by': None,
-            'coins': PROMO_COIN_AMOUNT,
-            'created_at': firestore.SERVER_TIMESTAMP,
-            'task_version': task_version,
-        })
-
-        db.collection('bot_users').document(str(user.id)).set({
-            'telegram_uid': str(user.id),
-            'telegram_name': user.full_name,
-            'completed_version': task_version,
-            'last_code': code,
-            'updated_at': firestore.SERVER_TIMESTAMP,
-        }, merge=True)
+        code, _ = await issue_reward(user, task_version, coins)
 
         await query.message.edit_text(
             f"🎉 Tabriklaymiz! Barcha vazifalar bajarildi!\n\n"
             f"🎁 Sizning promo kodingiz:\n\n"
             f"`{code}`\n\n"
-            f"💰 Bu kodni TDM Training ilovasiga kiriting va {PROMO_COIN_AMOUNT} coin oling!\n\n"
+            f"💰 Bu kodni TDM Training ilovasiga kiriting va {coins} coin oling!\n\n"
             f"✅ Kod ilovada faqat 1 marta ishlatilishi mumkin.",
             parse_mode='Markdown'
         )
@@ -462,6 +434,53 @@ async def check_subscriptions(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.message.reply_text("❌ Xatolik yuz berdi. Qayta urinib ko'ring: /start")
 
 
+# ============================================================
+# SAHIFALASH (admin ro'yxatlari)
+# ============================================================
+
+# callback_data 64 baytdan oshmasligi kerak: "admin_users:n:<mikrosoniya hex>.<uid>" ~40 bayt
+ADMIN_PAGE_SIZE = 20
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_user_cursor(doc):
+    micros = (doc.get('updated_at') - EPOCH) // timedelta(microseconds=1)
+    return f"{micros:x}.{doc.id}"
+
+
+def decode_user_cursor(token):
+    micros, _, user_id = token.partition('.')
+    return {'updated_at': EPOCH + timedelta(microseconds=int(micros, 16)), '__name__': user_id}
+
+
+def parse_page_cursor(cursor, decode):
+    """"n:<token>" / "p:<token>" -> (firestore cursor, orqagami)"""
+    if not cursor:
+        return None, False
+    direction, _, token = cursor.partition(':')
+    return decode(token), direction == 'p'
+
+
+def page_buttons(view, docs, has_prev, has_next, encode):
+    """Oldingi/keyingi tugmalari qatori (kerak bo'lmasa bo'sh ro'yxat)"""
+    row = []
+    if docs and has_prev:
+        row.append(InlineKeyboardButton("◀️ Oldingi", callback_data=f"{view}:p:{encode(docs[0])}"))
+    if docs and has_next:
+        row.append(InlineKeyboardButton("Keyingi ▶️", callback_data=f"{view}:n:{encode(docs[-1])}"))
+    return [row] if row else []
+
+
+async def show_page(query, cursor, text, keyboard, **kwargs):
+    """Birinchi sahifa yangi xabar, keyingilari shu xabarni tahrirlaydi"""
+    markup = InlineKeyboardMarkup(keyboard)
+    if cursor:
+        await query.edit_message_text(text, reply_markup=markup, **kwargs)
+    else:
+        await query.message.reply_text(text, reply_markup=markup, **kwargs)
+
+
 # ============================================================
 # ADMIN PANEL
 # ============================================================
@@ -487,6 +506,7 @@ async def show_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
+@instrumented(label=lambda update: update.callback_query.data.split(':')[0])
 async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin panel tugmalarini boshqarish"""
     query = update.callback_query
@@ -496,12 +516,13 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.message.reply_text("❌ Sizda ruxsat yo'q.")
         return
 
-    data = query.data
+    # Sahifalangan ro'yxatlar: "<view>:<n|p>:<cursor>"
+    data, _, cursor = query.data.partition(':')
 
     if data == "admin_stats":
         await handle_stats(query)
     elif data == "admin_users":
-        await handle_users(query)
+        await handle_users(query, cursor)
     elif data == "admin_codes":
         await handle_codes(query)
     elif data == "admin_channels":
@@ -523,9 +544,9 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "admin_back":
         await handle_back_to_panel(query)
     elif data == "admin_codes_used":
-        await handle_codes_filtered(query, 'used')
+        await handle_codes_filtered(query, 'used', cursor)
     elif data == "admin_codes_unused":
-        await handle_codes_filtered(query, 'unused')
+        await handle_codes_filtered(query, 'unused', cursor)
 
 
 def back_button():
@@ -554,12 +575,23 @@ async def handle_back_to_panel(query):
 
 async def handle_stats(query):
     try:
-        total_codes = len(list(db.collection('promo_codes').stream()))
-        used_codes = len(list(db.collection('promo_codes').where('used', '==', True).stream()))
+        task_version = await get_task_version()
+        (
+            total_codes, used_codes, version_codes,
+            total_users, completed_users,
+            (total_requests, version_requests),
+            pool_depth,
+        ) = await asyncio.gather(
+            count_documents('promo_codes'),
+            count_documents('promo_codes', [('used', '==', True)]),
+            count_documents('promo_codes', [('task_version', '==', task_version)]),
+            count_documents('bot_users'),
+            count_documents('bot_users', [('completed_version', '==', task_version)]),
+            get_request_totals(task_version),
+            get_code_pool_depth(),
+        )
         unused_codes = total_codes - used_codes
-        total_users = len(list(db.collection('bot_users').stream()))
-        total_requests = len(list(db.collection('user_requests').stream()))
-        channels = get_channels()
+        channels = await get_channels()
         
         regular_ch = len([ch for ch in channels if ch.get('type') in ['channel', 'link', None]])
         request_ch = len([ch for ch in channels if ch.get('type') == 'request'])
@@ -567,15 +599,19 @@ async def handle_stats(query):
         text = (
             f"📊 Statistika\n\n"
             f"👥 Foydalanuvchilar: {total_users}\n"
+            f"  ✅ V{task_version} ni bajarganlar: {completed_users}\n"
             f"🎫 Promo kodlar: {total_codes}\n"
             f"  ✅ Ishlatilgan: {used_codes}\n"
-            f"  ⏳ Ishlatilmagan: {unused_codes}\n\n"
+            f"  ⏳ Ishlatilmagan: {unused_codes}\n"
+            f"  🔄 V{task_version} kodlari: {version_codes}\n\n"
             f"📢 Kanallar: {len(channels)}\n"
             f"  📱 Oddiy: {regular_ch}\n"
             f"  🔐 Yopiq: {request_ch}\n\n"
             f"📤 Jami so'rovlar: {total_requests}\n"
-            f"🔄 Vazifa versiyasi: V{get_task_version()}\n"
-            f"💰 Coin miqdori: {PROMO_COIN_AMOUNT}"
+            f"  🔄 V{task_version} so'rovlari: {version_requests}\n"
+            f"🎟 Kod pooli: {pool_depth}\n"
+            f"🔄 Vazifa versiyasi: V{task_version}\n"
+            f"💰 Coin miqdori: {await get_promo_coins(PROMO_COIN_AMOUNT)}"
         )
     except Exception as e:
         text = f"❌ Statistika olishda xato: {e}"
@@ -584,33 +620,36 @@ async def handle_stats(query):
     await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def handle_users(query):
+async def handle_users(query, cursor=''):
+    keyboard = [back_button()]
     try:
-        users = list(db.collection('bot_users').order_by(
-            'updated_at', direction=firestore.Query.DESCENDING
-        ).limit(20).stream())
+        users, has_prev, has_next = await get_recent_users_page(
+            ADMIN_PAGE_SIZE, *parse_page_cursor(cursor, decode_user_cursor)
+        )
 
         if not users:
             text = "👥 Foydalanuvchilar yo'q."
         else:
-            text = f"👥 Oxirgi {len(users)} ta foydalanuvchi:\n\n"
+            text = f"👥 Oxirgi faol foydalanuvchilar ({len(users)} ta):\n\n"
             for i, u in enumerate(users, 1):
                 data = u.to_dict()
                 name = data.get('telegram_name', '?')
                 uid = data.get('telegram_uid', '?')
                 ver = data.get('completed_version', 0)
                 text += f"{i}. {name}\n   ID: {uid} | V{ver}\n"
+        keyboard = page_buttons("admin_users", users, has_prev, has_next, encode_user_cursor) + keyboard
     except Exception as e:
         text = f"❌ Xato: {e}"
 
-    keyboard = [back_button()]
-    await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    await show_page(query, cursor, text, keyboard)
 
 
 async def handle_codes(query):
     try:
-        total = len(list(db.collection('promo_codes').stream()))
-        used = len(list(db.collection('promo_codes').where('used', '==', True).stream()))
+        total, used = await asyncio.gather(
+            count_documents('promo_codes'),
+            count_documents('promo_codes', [('used', '==', True)]),
+        )
         unused = total - used
 
         text = (
@@ -631,14 +670,14 @@ async def handle_codes(query):
     await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def handle_codes_filtered(query, filter_type):
+async def handle_codes_filtered(query, filter_type, cursor=''):
+    keyboard = [back_button()]
     try:
-        if filter_type == 'used':
-            codes = list(db.collection('promo_codes').where('used', '==', True).limit(20).stream())
-            title = "✅ Ishlatilgan kodlar"
-        else:
-            codes = list(db.collection('promo_codes').where('used', '==', False).limit(20).stream())
-            title = "⏳ Ishlatilmagan kodlar"
+        used = filter_type == 'used'
+        title = "✅ Ishlatilgan kodlar" if used else "⏳ Ishlatilmagan kodlar"
+        codes, has_prev, has_next = await get_codes_page(
+            used, ADMIN_PAGE_SIZE, *parse_page_cursor(cursor, lambda code: {'__name__': code})
+        )
 
         if not codes:
             text = f"{title}\n\n❌ Kodlar yo'q."
@@ -650,15 +689,16 @@ async def handle_codes_filtered(query, filter_type):
                 tg_name = data.get('telegram_name', '?')
                 ver = data.get('task_version', '?')
                 text += f"`{code}` - {tg_name} (V{ver})\n"
+        view = "admin_codes_used" if used else "admin_codes_unused"
+        keyboard = page_buttons(view, codes, has_prev, has_next, lambda doc: doc.id) + keyboard
     except Exception as e:
         text = f"❌ Xato: {e}"
 
-    keyboard = [back_button()]
-    await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    await show_page(query, cursor, text, keyboard, parse_mode='Markdown')
 
 
 async def handle_channels(query):
-    channels = get_channels()
+    channels = await get_channels()
 
     if not channels:
         text = "📢 Kanallar ro'yxati bo'sh.\n\nKanal qo'shish uchun pastdagi tugmani bosing."
@@ -676,7 +716,7 @@ async def handle_channels(query):
             text += f"{i}. {emoji} {ch['name']}\n"
             text += f"   Tur: {ch_type}\n"
             text += f"   ID: {ch['id']}\n\n"
-        text += f"🔄 Vazifa versiyasi: V{get_task_version()}"
+        text += f"🔄 Vazifa versiyasi: V{await get_task_version()}"
 
     keyboard = [
         [InlineKeyboardButton("➕ Kanal qo'shish", callback_data="admin_add_ch"),
@@ -689,7 +729,7 @@ async def handle_channels(query):
 async def handle_coins_info(query):
     text = (
         f"💰 Coin sozlamalari\n\n"
-        f"Hozirgi miqdor: {PROMO_COIN_AMOUNT} coin\n\n"
+        f"Hozirgi miqdor: {await get_promo_coins(PROMO_COIN_AMOUNT)} coin\n\n"
         f"O'zgartirish uchun yozing:\n"
         f"/set_coins 10"
     )
@@ -699,10 +739,8 @@ async def handle_coins_info(query):
 
 async def handle_new_version(query):
     try:
-        version = get_task_version() + 1
-        db.collection('bot_config').document('settings').set(
-            {'task_version': version}, merge=True
-        )
+        version = await get_task_version() + 1
+        await set_task_version(version)
         text = (
             f"🔄 Yangi versiya yaratildi: V{version}\n\n"
             f"✅ Endi barcha foydalanuvchilar qayta vazifa bajarib,\n"
@@ -744,7 +782,7 @@ async def handle_add_channel_info(query):
 
 
 async def handle_remove_channel_info(query):
-    channels = get_channels()
+    channels = await get_channels()
 
     if not channels:
         text = "❌ Kanallar ro'yxati bo'sh."
@@ -767,7 +805,7 @@ async def handle_remove_channel_info(query):
 
 async def handle_view_tasks(query):
     """Admin user ko'rinishida vazifalarni ko'radi"""
-    channels = get_channels()
+    channels = await get_channels()
 
     if not channels:
         text = "❌ Hozircha vazifalar yo'q (kanallar qo'shilmagan)."
@@ -780,7 +818,7 @@ async def handle_view_tasks(query):
             f"📊 Kanallar soni: {len(channels)}\n"
             f"  📱 Oddiy: {len(regular_ch)}\n"
             f"  🔐 Yopiq: {len(request_ch)}\n"
-            f"💰 Mukofot: {PROMO_COIN_AMOUNT} coin\n\n"
+            f"💰 Mukofot: {await get_promo_coins(PROMO_COIN_AMOUNT)} coin\n\n"
         )
         
         if regular_ch:
@@ -801,22 +839,23 @@ async def handle_view_tasks(query):
 async def handle_requests_stats(query):
     """So'rovlar statistikasini ko'rsatish"""
     try:
-        task_version = get_task_version()
-        all_requests = list(db.collection('user_requests').stream())
-        current_version_requests = [r for r in all_requests if r.to_dict().get('task_version') == task_version]
-        
-        channels = get_channels()
+        task_version = await get_task_version()
+        channels = await get_channels()
         request_channels = [ch for ch in channels if ch.get('type') == 'request']
+
+        (_, total_requests), channel_counts = await asyncio.gather(
+            get_request_totals(task_version),
+            get_request_counts(task_version, [ch['id'] for ch in request_channels]),
+        )
         
         text = f"📋 So'rovlar statistikasi (V{task_version}):\n\n"
-        text += f"📤 Jami so'rovlar: {len(current_version_requests)}\n"
+        text += f"📤 Jami so'rovlar: {total_requests}\n"
         text += f"🔐 Yopiq kanallar: {len(request_channels)}\n\n"
         
         if request_channels:
             text += "Kanallar bo'yicha:\n"
             for ch in request_channels:
-                ch_requests = [r for r in current_version_requests if r.to_dict().get('channel_id') == ch['id']]
-                text += f"• {ch['name']}: {len(ch_requests)} ta so'rov\n"
+                text += f"• {ch['name']}: {channel_counts[ch['id']]} ta so'rov\n"
         else:
             text += "❌ Yopiq kanallar yo'q."
     except Exception as e:
@@ -830,6 +869,7 @@ async def handle_requests_stats(query):
 # ADMIN COMMAND HANDLERLARI (buyruqlar orqali)
 # ============================================================
 
+@instrumented
 async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
@@ -861,7 +901,7 @@ async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    channels = get_channels()
+    channels = await get_channels()
     
     # Kanal allaqachon mavjudligini tekshirish
     if any(ch['id'] == ch_id for ch in channels):
@@ -878,12 +918,10 @@ async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         'type': ch_type,
     })
 
-    db.collection('bot_config').document('channels').set({'list': channels})
+    await save_channels(channels)
 
-    version = get_task_version() + 1
-    db.collection('bot_config').document('settings').set(
-        {'task_version': version}, merge=True
-    )
+    version = await get_task_version() + 1
+    await set_task_version(version)
 
     type_emoji = "📱" if ch_type == 'channel' else "🔐" if ch_type == 'request' else "🔗"
     
@@ -897,13 +935,14 @@ async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@instrumented
 async def remove_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
 
     args = context.args
     if not args:
-        channels = get_channels()
+        channels = await get_channels()
         if not channels:
             await update.message.reply_text("❌ Kanallar ro'yxati bo'sh.")
             return
@@ -917,7 +956,7 @@ async def remove_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     channel_id = args[0]
-    channels = get_channels()
+    channels = await get_channels()
     
     # O'chiriladigan kanalni topish
     channel_to_remove = next((ch for ch in channels if ch['id'] == channel_id), None)
@@ -928,7 +967,7 @@ async def remove_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     new_channels = [ch for ch in channels if ch['id'] != channel_id]
 
-    db.collection('bot_config').document('channels').set({'list': new_channels})
+    await save_channels(new_channels)
     
     await update.message.reply_text(
         f"✅ Kanal o'chirildi!\n\n"
@@ -937,73 +976,81 @@ async def remove_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@instrumented
 async def set_coins(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global PROMO_COIN_AMOUNT
-
     if not is_admin(update.effective_user.id):
         return
 
     if not context.args or not context.args[0].isdigit():
         await update.message.reply_text(
-            f"💰 Hozirgi: {PROMO_COIN_AMOUNT} coin\n\n"
+            f"💰 Hozirgi: {await get_promo_coins(PROMO_COIN_AMOUNT)} coin\n\n"
             f"Format: /set_coins <son>\n"
             f"Misol: /set_coins 50"
         )
         return
 
-    PROMO_COIN_AMOUNT = int(context.args[0])
-    db.collection('bot_config').document('settings').set(
-        {'promo_coins': PROMO_COIN_AMOUNT}, merge=True
-    )
+    amount = int(context.args[0])
+    await set_promo_coins(amount)
 
     await update.message.reply_text(
         f"✅ Coin miqdori o'zgardi!\n\n"
-        f"💰 Yangi qiymat: {PROMO_COIN_AMOUNT} coin"
+        f"💰 Yangi qiymat: {amount} coin"
     )
 
 
+@instrumented
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
 
     if not context.args:
+        segments = "\n".join(f"• {name} - {title}" for name, title in BROADCAST_SEGMENTS.items())
         await update.message.reply_text(
-            "📤 Format: /broadcast <xabar matni>\n\n"
-            "Misol:\n"
-            "/broadcast Yangi vazifalar qo'shildi!"
+            "📤 Format: /broadcast [segment] <xabar matni>\n\n"
+            f"Segmentlar:\n{segments}\n\n"
+            "Misollar:\n"
+            "/broadcast Yangi vazifalar qo'shildi!\n"
+            "/broadcast incomplete Yangi vazifalarni bajaring!\n\n"
+            "Faqat segment yozilsa - nechta userga borishi ko'rsatiladi:\n"
+            "/broadcast unused"
         )
         return
 
-    message_text = ' '.join(context.args)
-    users = list(db.collection('bot_users').stream())
+    args = list(context.args)
+    segment = args.pop(0) if args[0] in BROADCAST_SEGMENTS else 'all'
+    task_version = await get_task_version()
+    total = await count_segment(segment, task_version)
 
-    await update.message.reply_text(
+    # Matnsiz - faqat auditoriya hajmini ko'rsatish (dry-run)
+    if not args:
+        await update.message.reply_text(
+            f"👥 Segment: {segment} ({BROADCAST_SEGMENTS[segment]})\n"
+            f"📊 Auditoriya: {total} ta foydalanuvchi\n\n"
+            f"Yuborish uchun: /broadcast {segment} <xabar matni>"
+        )
+        return
+
+    message_text = ' '.join(args)
+    status = await update.message.reply_text(
         f"📤 Xabar yuborilmoqda...\n"
-        f"👥 Jami foydalanuvchilar: {len(users)}"
+        f"👥 Segment: {segment} | Auditoriya: {total}"
     )
 
-    sent = 0
-    failed = 0
-    for u in users:
-        data = u.to_dict()
-        tg_id = data.get('telegram_uid')
-        if tg_id:
-            try:
-                await context.bot.send_message(
-                    chat_id=int(tg_id),
-                    text=f"📢 Admin xabari:\n\n{message_text}"
-                )
-                sent += 1
-            except Exception:
-                failed += 1
+    job = {
+        'text': f"📢 Admin xabari:\n\n{message_text}",
+        'segment': segment,
+        'task_version': task_version,
+        'admin_chat_id': status.chat_id,
+        'status_message_id': status.message_id,
+        'total': total,
+    }
+    job_id = await create_broadcast_job(job)
 
-    await update.message.reply_text(
-        f"✅ Broadcast tugadi!\n\n"
-        f"📤 Yuborildi: {sent}\n"
-        f"❌ Xatolik: {failed}"
-    )
+    # Fonda yuboriladi - admin handleri bloklanmaydi, restartdan keyin davom etadi
+    start_background(run_broadcast_job(context.bot, job_id, job))
 
 
+@instrumented
 async def user_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
@@ -1017,28 +1064,19 @@ async def user_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     tg_id = context.args[0]
     try:
-        user_doc = db.collection('bot_users').document(tg_id).get()
-        if not user_doc.exists:
+        data = await get_bot_user(tg_id)
+        if not data:
             await update.message.reply_text(f"❌ Foydalanuvchi topilmadi: {tg_id}")
             return
 
-        data = user_doc.to_dict()
         name = data.get('telegram_name', '?')
         ver = data.get('completed_version', 0)
         code = data.get('last_code', '-')
 
-        user_codes = list(
-            db.collection('promo_codes')
-            .where('telegram_uid', '==', tg_id)
-            .stream()
-        )
+        user_codes = await get_codes_for_user(tg_id)
         
         # So'rovlar
-        user_requests = list(
-            db.collection('user_requests')
-            .where('user_id', '==', tg_id)
-            .stream()
-        )
+        request_count = await count_user_requests(tg_id, data)
 
         text = (
             f"👤 Foydalanuvchi ma'lumotlari:\n\n"
@@ -1047,7 +1085,7 @@ async def user_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"🔄 Versiya: V{ver}\n"
             f"🎁 Oxirgi kod: `{code}`\n"
             f"🎫 Jami kodlari: {len(user_codes)}\n"
-            f"📤 Jami so'rovlari: {len(user_requests)}\n\n"
+            f"📤 Jami so'rovlari: {request_count}\n\n"
         )
 
         if user_codes:
@@ -1062,6 +1100,100 @@ async def user_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"❌ Xato: {e}")
 
 
+@instrumented
+async def migrate_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """user_requests -> bot_users.progress migratsiyasini fonda ishga tushirish"""
+    if not is_admin(update.effective_user.id):
+        return
+
+    await update.message.reply_text("🔄 So'rovlar migratsiyasi boshlandi...")
+
+    async def run():
+        try:
+            migrated = await backfill_user_progress()
+            await update.message.reply_text(
+                f"✅ Migratsiya tugadi!\n\n"
+                f"📤 Ko'chirilgan so'rovlar: {migrated}"
+            )
+        except Exception as e:
+            print(f"[MIGRATE ERROR] {e}")
+            await update.message.reply_text(f"❌ Migratsiyada xato: {e}")
+
+    start_background(run())
+
+
+@instrumented
+async def refill_codes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Promo kod poolini qo'lda to'ldirish: /refill_codes [son]"""
+    if not is_admin(update.effective_user.id):
+        return
+
+    target = int(context.args[0]) if context.args and context.args[0].isdigit() else None
+    await update.message.reply_text("🎟 Kod pooli to'ldirilmoqda...")
+
+    async def run():
+        try:
+            added = await refill_code_pool(target or CODE_POOL_TARGET)
+            await update.message.reply_text(
+                f"✅ Kod pooli to'ldirildi!\n\n"
+                f"➕ Qo'shildi: {added}\n"
+                f"🎟 Pooldagi kodlar: {code_pool_stats['depth']}"
+            )
+        except Exception as e:
+            print(f"[CODE POOL ERROR] {e}")
+            await update.message.reply_text(f"❌ Xato: {e}")
+
+    start_background(run())
+
+
+@instrumented
+async def sync_code_flags(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """bot_users.has_unused_code ni promo_codes bilan qo'lda moslashtirish (to'liq skan)"""
+    if not is_admin(update.effective_user.id):
+        return
+
+    await update.message.reply_text("🔄 Kod bayroqlari tekshirilmoqda...")
+
+    async def run():
+        try:
+            changed = await sync_unused_code_flags()
+            await update.message.reply_text(f"✅ Kod bayroqlari yangilandi: {changed} ta user")
+        except Exception as e:
+            print(f"[CODE FLAGS ERROR] {e}")
+            await update.message.reply_text(f"❌ Xato: {e}")
+
+    start_background(run())
+
+
+@instrumented
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Kolleksiyani siqilgan CSV/JSONL fayl qilib yuborish (fonda)"""
+    if not is_admin(update.effective_user.id):
+        return
+
+    try:
+        collection, export_filters, fmt = parse_export_args(context.args)
+    except ValueError as e:
+        aliases = {name: alias for alias, name in EXPORT_ALIASES.items()}
+        collections = "\n".join(f"• {name} ({aliases[name]})" for name in EXPORT_COLLECTIONS)
+        await update.message.reply_text(
+            f"❌ {e}\n\n"
+            "📦 Format: /export <kolleksiya> [maydon=qiymat ...] [csv|jsonl]\n\n"
+            f"Kolleksiyalar:\n{collections}\n\n"
+            "Misollar:\n"
+            "/export users\n"
+            "/export codes used=false task_version=3\n"
+            "/export requests user_id='123456789' jsonl\n\n"
+            "Qo'shtirnoq ichidagi qiymat matn sifatida solishtiriladi."
+        )
+        return
+
+    status = await update.message.reply_text(f"📦 {collection} eksport qilinmoqda ({fmt}.gz)...")
+    # Fonda - katta kolleksiyalarda ham bot boshqa userlarga javob beraveradi
+    start_background(run_export(context.bot, status, collection, export_filters, fmt))
+
+
+@instrumented
 async def panel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin /panel buyrug'i"""
     if is_admin(update.effective_user.id):
@@ -1070,6 +1202,81 @@ async def panel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Sizda ruxsat yo'q.")
 
 
+@instrumented
+async def perf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/perf [daqiqa] - latency va Firestore RPC lar, /perf profile [soniya] - sampling profil"""
+    if not is_admin(update.effective_user.id):
+        return
+
+    args = context.args or []
+    if args and args[0] == 'profile':
+        seconds = int(args[1]) if len(args) > 1 and args[1].isdigit() else 10
+        seconds = min(seconds, PROFILE_MAX_SECONDS)
+        await update.message.reply_text(f"🔬 Profil yozilmoqda ({seconds} s)...")
+
+        async def run():
+            try:
+                report = await profile_event_loop(seconds)
+                await update.message.reply_document(
+                    document=io.BytesIO(report.encode()),
+                    filename=f"profile_{datetime.now():%Y%m%d_%H%M%S}.txt",
+                    caption=f"🔬 {seconds} s sampling profil",
+                )
+            except Exception as e:
+                print(f"[PERF ERROR] {e}")
+                await update.message.reply_text(f"❌ Profil xatosi: {e}")
+
+        start_background(run())
+        return
+
+    minutes = int(args[0]) if args and args[0].isdigit() else 15
+    summary = perf_summary(minutes)
+    if not summary:
+        await update.message.reply_text(f"📭 Oxirgi {minutes} daqiqada so'rovlar yo'q.")
+        return
+
+    text = f"⏱ Oxirgi {minutes} daqiqa (ms, RPC/o'qish/yozish - o'rtacha)\n\n"
+    for name, row in sorted(summary.items(), key=lambda item: -item[1]['count']):
+        text += (
+            f"{'Jami' if name == '*' else name}: {row['count']} ta\n"
+            f"  p50 {row['p50'] * 1000:.0f} | p95 {row['p95'] * 1000:.0f} | p99 {row['p99'] * 1000:.0f}\n"
+            f"  RPC {row['rpcs']:.1f} | o'qish {row['reads']:.1f} | yozish {row['writes']:.1f}\n\n"
+        )
+    text += "🔬 Profil: /perf profile [soniya]"
+    await update.message.reply_text(text)
+
+
+# ============================================================
+# UPDATE LARNI PARALLEL ISHLASH
+# ============================================================
+
+class PerUserUpdateProcessor(SimpleUpdateProcessor):
+    """Turli userlarning update lari parallel, bitta userniki kelgan tartibida ishlanadi.
+
+    User navbati umumiy limitdan oldin olinadi - navbatda turgan update slot band qilmaydi.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._user_locks = {}
+
+    async def process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._user_locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._user_locks[user.id]
+
+
 # ============================================================
 # MAIN
 # ============================================================
@@ -1079,12 +1286,146 @@ async def error_handler(update, context):
     print(f"[ERROR] {context.error}")
 
 
-def main():
-    health_thread = threading.Thread(target=start_health_server, daemon=True)
-    health_thread.start()
-    print(f"✅ Health server ishga tushdi (port {os.getenv('PORT', 8000)})")
+# Fon vazifalari app.create_task bilan emas, shu yerda kuzatiladi: Application.stop() o'zi
+# boshlagan vazifalarning tugashini kutadi, cheksiz workerlar esa hech qachon tugamaydi
+background_tasks = set()
+
+
+def start_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def stop_background():
+    """Fon vazifalarini bekor qilish (broadcastlar restartdan keyin cursor dan davom etadi)"""
+    tasks = list(background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def post_init(app: Application):
+    """Bot ishga tushgach fon vazifalarini boshlash"""
+    start_background(code_pool_worker())
+    if PROMO_API_KEY:
+        start_background(audit_worker())
+    await resume_broadcast_jobs(app.bot, start_background)
+    start_background(broadcast_resume_worker(app.bot, start_background))
+
+
+# /health shu holatni qaytaradi: starting -> ready (yoki failed)
+readiness_state = {'state': 'starting', 'cold_start_seconds': None, 'settings': None}
+
+
+def http_routes(app: Application):
+    """Health check, metrikalar, promo kod API va (webhook rejimida) Telegram update larini qabul qilish"""
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    async def health(request):
+        return text_response("OK")
+
+    async def readiness(request):
+        status = 200 if readiness_state['state'] == 'ready' else 503
+        return text_response(json.dumps(readiness_state), status, content_type="application/json")
+
+    async def telegram_webhook(request):
+        token = request.headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+            return text_response("Forbidden", 403)
+        try:
+            payload = json.loads(request.body)
+        except ValueError:
+            return text_response("Bad Request", 400)
+        if not isinstance(payload, dict):
+            return text_response("Bad Request", 400)
+        update = Update.de_json(payload, app.bot)
+        await app.update_queue.put(update)
+        return text_response("OK")
+
+    async def metrics(request):
+        return text_response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    routes = {('GET', '/'): health, ('GET', '/health'): readiness, ('GET', '/metrics'): metrics}
+    if WEBHOOK_URL:
+        routes[('POST', WEBHOOK_PATH)] = telegram_webhook
+    if PROMO_API_KEY:
+        routes.update(promo_api_routes())
+    return routes
+
+
+async def run_bot(app: Application):
+    # Health server birinchi ochiladi - platforma startup davomida ham javob oladi
+    server = await start_http_server(http_routes(app), PORT)
+    print(f"✅ HTTP server ishga tushdi (port {PORT}, {time.perf_counter() - BOOT_STARTED:.2f} s)")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    try:
+        # Firebase + sozlamalar va Telegram (getMe) parallel tayyorlanadi
+        warm_started = time.perf_counter()
+        settings, _, _ = await asyncio.gather(
+            warm_up(), app.initialize(), asyncio.to_thread(start_config_listener)
+        )
+        print(
+            f"✅ Sozlamalar yuklandi ({time.perf_counter() - warm_started:.2f} s): "
+            f"kanallar {settings['channels']}, versiya {settings['task_version']}, "
+            f"coin {settings['promo_coins'] if settings['promo_coins'] is not None else PROMO_COIN_AMOUNT}"
+        )
+        readiness_state['settings'] = settings
+    except Exception:
+        readiness_state['state'] = 'failed'
+        server.close()
+        raise
+
+    async with app:
+        await app.start()
+        await post_init(app)
+        if WEBHOOK_URL:
+            # Bir nechta instans bo'lsa ham bir xil URL o'rnatiladi; navbatdagi update lar tashlanmaydi
+            await app.bot.set_webhook(
+                f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            print(f"🌐 Webhook rejimi: {WEBHOOK_URL}{WEBHOOK_PATH}")
+        else:
+            await app.updater.start_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES)
+            print("🔄 Polling rejimi")
+
+        readiness_state['cold_start_seconds'] = round(time.perf_counter() - BOOT_STARTED, 3)
+        readiness_state['state'] = 'ready'
+        print(f"🚀 Bot ishga tushdi! (cold start: {readiness_state['cold_start_seconds']} s)")
+        try:
+            await stop.wait()
+        finally:
+            if app.updater and app.updater.running:
+                await app.updater.stop()
+            await stop_background()
+            await app.stop()
+            server.close()
+            await flush_audit()
+
+
+def main():
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+    )
+    if WEBHOOK_URL:
+        # Update lar HTTP orqali keladi - polling uchun Updater kerak emas
+        builder = builder.updater(None)
+    app = builder.build()
 
     # Error handler
     app.add_error_handler(error_handler)
@@ -1092,8 +1433,10 @@ def main():
     # User buyruqlari
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("panel", panel_command))
+    app.add_handler(CommandHandler("perf", perf_command))
     app.add_handler(CallbackQueryHandler(check_subscriptions, pattern="^check_subs$"))
     app.add_handler(CallbackQueryHandler(mark_requested, pattern="^mark_requested$"))
+    app.add_handler(ChatMemberHandler(track_chat_member, ChatMemberHandler.CHAT_MEMBER))
 
     # Admin panel tugmalari
     app.add_handler(CallbackQueryHandler(admin_callback, pattern="^admin_"))
@@ -1104,9 +1447,12 @@ def main():
     app.add_handler(CommandHandler("set_coins", set_coins))
     app.add_handler(CommandHandler("broadcast", broadcast))
     app.add_handler(CommandHandler("user_info", user_info))
+    app.add_handler(CommandHandler("migrate_requests", migrate_requests))
+    app.add_handler(CommandHandler("refill_codes", refill_codes))
+    app.add_handler(CommandHandler("sync_code_flags", sync_code_flags))
+    app.add_handler(CommandHandler("export", export_command))
 
-    print("🚀 Bot ishga tushdi!")
-    app.run_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES)
+    asyncio.run(run_bot(app))
 
 
 if __name__ == "__main__":
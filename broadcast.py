@@ -0,0 +1,242 @@
+import os
+import time
+import asyncio
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+from repository import (
+    get_user_page, user_page_cursor, mark_user_inactive,
+    update_broadcast_job, get_unfinished_broadcast_jobs, claim_broadcast_job,
+    BROADCAST_LEASE_SECONDS,
+)
+
+
+# ============================================================
+# BROADCAST SOZLAMALARI
+# ============================================================
+
+# Telegram: umumiy ~30 xabar/soniya, bitta chatga ~1 xabar/soniya
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+BROADCAST_PER_CHAT_INTERVAL = 1.0
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", 10))
+BROADCAST_MAX_RETRIES = 3
+BROADCAST_PROGRESS_INTERVAL = 5
+# Userlar shu o'lchamdagi sahifalar bilan o'qiladi, har sahifadan keyin job saqlanadi
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", 200))
+
+# Shu instansda yuborilayotgan joblar (lease muddati o'tsa ham ikkinchi marta boshlanmaydi)
+_running_jobs = set()
+
+
+# ============================================================
+# RATE LIMITER
+# ============================================================
+
+class TokenBucket:
+    """Token bucket: soniyasiga `rate` ta, bir martada `capacity` tagacha xabar"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """429 (RetryAfter) kelganda barcha yuborishlarni to'xtatib turish"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Barcha broadcastlar uchun umumiy limit
+global_bucket = TokenBucket(BROADCAST_RATE)
+_last_sent = {}
+
+
+async def _wait_for_chat(chat_id):
+    if len(_last_sent) > 10000:
+        old = time.monotonic() - BROADCAST_PER_CHAT_INTERVAL
+        for key in [k for k, sent_at in _last_sent.items() if sent_at < old]:
+            del _last_sent[key]
+    wait = _last_sent.get(chat_id, 0) + BROADCAST_PER_CHAT_INTERVAL - time.monotonic()
+    if wait > 0:
+        await asyncio.sleep(wait)
+    _last_sent[chat_id] = time.monotonic()
+
+
+# ============================================================
+# YUBORISH
+# ============================================================
+
+async def send_with_retry(bot, chat_id, text):
+    """Xabar yuborish: 'sent' | 'blocked' | 'failed'"""
+    for attempt in range(BROADCAST_MAX_RETRIES):
+        await global_bucket.acquire()
+        await _wait_for_chat(chat_id)
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+            return 'sent'
+        except RetryAfter as e:
+            print(f"[BROADCAST] Flood limit, {e.retry_after} s kutiladi")
+            global_bucket.pause(e.retry_after)
+        except Forbidden:
+            return 'blocked'
+        except BadRequest as e:
+            print(f"[BROADCAST] {chat_id}: {e}")
+            return 'failed'
+        except (TimedOut, NetworkError):
+            await asyncio.sleep(2 ** attempt)
+    return 'failed'
+
+
+def progress_text(stats, done=False):
+    title = "✅ Broadcast tugadi!" if done else "📤 Xabar yuborilmoqda..."
+    text = (
+        f"{title}\n\n"
+        f"📤 Yuborildi: {stats['sent']}\n"
+        f"❌ Xatolik: {stats['failed']}\n"
+    )
+    if stats.get('blocked'):
+        text += f"🚫 Botni bloklagan: {stats['blocked']}\n"
+    if stats.get('total') is not None:
+        text += f"👥 Jami: {stats['total']}\n"
+    return text
+
+
+async def _edit_status(bot, job, text):
+    try:
+        await bot.edit_message_text(
+            text=text, chat_id=job['admin_chat_id'], message_id=job['status_message_id']
+        )
+    except Exception as e:
+        print(f"[BROADCAST] Status yangilanmadi: {e}")
+
+
+async def _report_progress(bot, job, stats):
+    last_text = None
+    while True:
+        await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+        text = progress_text(stats)
+        if text != last_text:
+            await _edit_status(bot, job, text)
+            last_text = text
+
+
+async def run_broadcast_job(bot, job_id, job):
+    """broadcast_jobs dagi jobni cursor dan davom ettirib oxirigacha yuborish"""
+    stats = {
+        'sent': job.get('sent', 0),
+        'failed': job.get('failed', 0),
+        'blocked': job.get('blocked', 0),
+        'total': job.get('total'),
+    }
+    cursor = job.get('cursor')
+    text = job['text']
+    queue = asyncio.Queue(maxsize=BROADCAST_WORKERS * 2)
+
+    async def worker():
+        while True:
+            chat_id = await queue.get()
+            try:
+                result = await send_with_retry(bot, chat_id, text)
+                if result == 'sent':
+                    stats['sent'] += 1
+                else:
+                    stats['failed'] += 1
+                if result == 'blocked':
+                    stats['blocked'] += 1
+                    await mark_user_inactive(chat_id)
+            except Exception as e:
+                print(f"[BROADCAST] {chat_id}: {e}")
+                stats['failed'] += 1
+            finally:
+                queue.task_done()
+
+    print(f"[BROADCAST] Job {job_id} boshlandi (cursor: {cursor})")
+    _running_jobs.add(job_id)
+    workers = [asyncio.create_task(worker()) for _ in range(BROADCAST_WORKERS)]
+    reporter = asyncio.create_task(_report_progress(bot, job, stats))
+    try:
+        while True:
+            page = await get_user_page(
+                BROADCAST_PAGE_SIZE, cursor, job.get('segment', 'all'), job.get('task_version')
+            )
+            if not page:
+                break
+            for doc in page:
+                data = doc.to_dict()
+                if data.get('active') is False or not data.get('telegram_uid'):
+                    continue
+                await queue.put(int(data['telegram_uid']))
+
+            # Sahifa to'liq yuborilgach cursor saqlanadi - qayta ishga tushganda shu yerdan davom etadi
+            await queue.join()
+            cursor = user_page_cursor(page[-1], job.get('segment', 'all'), job.get('task_version'))
+            owned = await update_broadcast_job(job_id, {
+                'cursor': cursor,
+                'sent': stats['sent'],
+                'failed': stats['failed'],
+                'blocked': stats['blocked'],
+            })
+            if not owned:
+                print(f"[BROADCAST] Job {job_id} boshqa instansga o'tdi - to'xtatildi")
+                return stats
+            if len(page) < BROADCAST_PAGE_SIZE:
+                break
+
+        await update_broadcast_job(job_id, {'status': 'done'}, release=True)
+    except asyncio.CancelledError:
+        # Bot to'xtatilmoqda: lease bo'shatiladi, job keyingi ishga tushishda cursor dan davom etadi
+        try:
+            await update_broadcast_job(job_id, {}, release=True)
+        except Exception as e:
+            print(f"[BROADCAST] Job {job_id} lease bo'shatilmadi: {e}")
+        raise
+    finally:
+        _running_jobs.discard(job_id)
+        reporter.cancel()
+        for task in workers:
+            task.cancel()
+
+    await _edit_status(bot, job, progress_text(stats, done=True))
+    print(f"[BROADCAST] Job {job_id} tugadi: {stats}")
+    return stats
+
+
+async def resume_broadcast_jobs(bot, start_task):
+    """Lease i tugagan (egasi to'xtagan) broadcastlarni olib davom ettirish"""
+    try:
+        jobs = await get_unfinished_broadcast_jobs()
+    except Exception as e:
+        print(f"[BROADCAST] Joblarni o'qishda xato: {e}")
+        return
+    for job_id, _ in jobs:
+        if job_id in _running_jobs:
+            continue
+        try:
+            job = await claim_broadcast_job(job_id)
+        except Exception as e:
+            print(f"[BROADCAST] Job {job_id} olinmadi: {e}")
+            continue
+        if job:
+            start_task(run_broadcast_job(bot, job_id, job))
+
+
+async def broadcast_resume_worker(bot, start_task, interval=BROADCAST_LEASE_SECONDS):
+    """Boshqa instans yiqilsa uning joblari lease tugagach shu yerda davom etadi"""
+    while True:
+        await asyncio.sleep(interval)
+        await resume_broadcast_jobs(bot, start_task)
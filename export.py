@@ -0,0 +1,198 @@
+import io
+import os
+import csv
+import gzip
+import json
+import time
+import asyncio
+import tempfile
+from datetime import datetime
+from repository import iter_collection_pages, iter_request_pages
+
+
+# ============================================================
+# EKSPORT SOZLAMALARI (/export)
+# ============================================================
+#
+# Kolleksiya sahifalab o'qiladi va gzip bilan vaqtinchalik faylga yoziladi: xotirada faqat
+# bitta sahifa turadi, siqish/yozish thread da bajariladi - event loop bloklanmaydi.
+
+# Kolleksiya -> CSV ustunlari (JSONL da hujjat to'liq yoziladi)
+EXPORT_COLLECTIONS = {
+    'bot_users': [
+        'telegram_uid', 'telegram_name', 'completed_version', 'last_code', 'has_unused_code',
+        'active', 'created_at', 'updated_at', 'blocked_at',
+    ],
+    'promo_codes': [
+        'code', 'telegram_uid', 'telegram_name', 'task_version', 'coins',
+        'used', 'used_by', 'used_at', 'created_at',
+    ],
+    'user_requests': ['user_id', 'channel_id', 'task_version', 'requested_at'],
+}
+EXPORT_ALIASES = {'users': 'bot_users', 'codes': 'promo_codes', 'requests': 'user_requests'}
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", 1000))
+EXPORT_PROGRESS_INTERVAL = 10
+# Bot API orqali yuklanadigan fayl chegarasi
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+# Hozir eksport qilinayotgan kolleksiyalar (bittasi bir vaqtda bir marta)
+_active_exports = set()
+
+
+def _parse_value(text):
+    """'true' -> True, '3' -> 3, "'3'" -> '3' (qo'shtirnoq ichidagisi har doim matn)"""
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        return text[1:-1]
+    lowered = text.lower()
+    if lowered in ('true', 'false'):
+        return lowered == 'true'
+    if lowered in ('null', 'none'):
+        return None
+    if text.lstrip('-').isdigit():
+        return int(text)
+    return text
+
+
+def parse_export_args(args):
+    """[kolleksiya, maydon=qiymat..., csv|jsonl] -> (kolleksiya, filtrlar, format)"""
+    if not args:
+        raise ValueError("Kolleksiya ko'rsatilmagan")
+    collection = EXPORT_ALIASES.get(args[0], args[0])
+    if collection not in EXPORT_COLLECTIONS:
+        raise ValueError(f"Noma'lum kolleksiya: {args[0]}")
+
+    filters, fmt = [], 'csv'
+    for arg in args[1:]:
+        if arg.lower() in EXPORT_FORMATS:
+            fmt = arg.lower()
+            continue
+        field, sep, value = arg.partition('=')
+        if not sep or not field:
+            raise ValueError(f"Filtr formati maydon=qiymat bo'lishi kerak: {arg}")
+        filters.append((field, '==', _parse_value(value)))
+    return collection, filters, fmt
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, 'path'):
+        # DocumentReference
+        return value.path
+    return str(value)
+
+
+def _csv_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=_json_default, ensure_ascii=False)
+    return value
+
+
+class ExportWriter:
+    """Qatorlarni gzip li vaqtinchalik faylga yozish (metodlari thread da chaqiriladi)"""
+
+    def __init__(self, fmt, columns):
+        self.fmt = fmt
+        self.columns = columns
+        self.file = tempfile.TemporaryFile()
+        self.stream = io.TextIOWrapper(
+            gzip.GzipFile(fileobj=self.file, mode='wb'), encoding='utf-8', newline=''
+        )
+        if fmt == 'csv':
+            self.csv = csv.writer(self.stream)
+            self.csv.writerow(['id', *columns])
+
+    def write_page(self, rows):
+        for doc_id, data in rows:
+            if self.fmt == 'csv':
+                self.csv.writerow([doc_id, *(_csv_cell(data.get(column)) for column in self.columns)])
+            else:
+                self.stream.write(json.dumps({'id': doc_id, **data}, default=_json_default, ensure_ascii=False))
+                self.stream.write('\n')
+
+    def finish(self):
+        """gzip ni yopish, fayl hajmini qaytarish (fayl o'qishga tayyor)"""
+        self.stream.close()
+        size = self.file.tell()
+        self.file.seek(0)
+        return size
+
+
+# ============================================================
+# EKSPORT JOBI
+# ============================================================
+
+async def _iter_rows(collection, filters):
+    """(hujjat ID, ma'lumot) sahifalari. user_requests migratsiyadan keyin bot_users.progress dan"""
+    if collection == 'user_requests':
+        async for rows in iter_request_pages(filters, EXPORT_PAGE_SIZE):
+            yield rows
+        return
+    async for docs in iter_collection_pages(collection, filters, EXPORT_PAGE_SIZE):
+        yield [(doc.id, doc.to_dict()) for doc in docs]
+
+
+async def run_export(bot, status_message, collection, filters, fmt):
+    """Fonda: kolleksiyani faylga yozib, admin chatiga send_document bilan yuborish"""
+    if collection in _active_exports:
+        await status_message.edit_text(f"⏳ {collection} eksporti allaqachon ishlayapti.")
+        return
+
+    _active_exports.add(collection)
+    started = time.monotonic()
+    last_progress = started
+    rows = 0
+    writer = None
+    try:
+        writer = await asyncio.to_thread(ExportWriter, fmt, EXPORT_COLLECTIONS[collection])
+        async for page in _iter_rows(collection, filters):
+            await asyncio.to_thread(writer.write_page, page)
+            rows += len(page)
+
+            if time.monotonic() - last_progress >= EXPORT_PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                try:
+                    await status_message.edit_text(f"📦 {collection} eksport qilinmoqda...\n📊 Qatorlar: {rows}")
+                except Exception:
+                    pass
+
+        size = await asyncio.to_thread(writer.finish)
+        elapsed = time.monotonic() - started
+        print(f"[EXPORT] {collection}: {rows} qator, {size / 1024:.0f} KB, {elapsed:.1f} s")
+        if size > TELEGRAM_UPLOAD_LIMIT:
+            await status_message.edit_text(
+                f"❌ Fayl juda katta: {size / 2 ** 20:.1f} MB (chegara 50 MB).\n"
+                f"Filtr qo'shib qayta urinib ko'ring."
+            )
+            return
+
+        filter_text = ', '.join(f"{field}={value!r}" for field, _, value in filters) or "yo'q"
+        await bot.send_document(
+            status_message.chat_id,
+            document=writer.file,
+            filename=f"{collection}-{datetime.now():%Y%m%d-%H%M%S}.{fmt}.gz",
+            caption=(
+                f"📦 {collection} ({fmt})\n"
+                f"📊 Qatorlar: {rows}\n"
+                f"🔎 Filtr: {filter_text}\n"
+                f"⏱ {elapsed:.1f} s"
+            ),
+            write_timeout=300,
+        )
+        await status_message.edit_text(f"✅ {collection} eksporti tugadi: {rows} qator.")
+    except Exception as e:
+        print(f"[EXPORT ERROR] {collection}: {e}")
+        try:
+            await status_message.edit_text(f"❌ Eksportda xato: {e}")
+        except Exception:
+            pass
+    finally:
+        if writer:
+            writer.file.close()
+        _active_exports.discard(collection)
@@ -0,0 +1,276 @@
+import time
+import functools
+import contextvars
+from collections import defaultdict, deque
+from telegram.request import HTTPXRequest
+
+
+# ============================================================
+# METRIKALAR (Prometheus text formati, /metrics)
+# ============================================================
+
+# Firestore so'rovlari qaysi handlerga tegishli ekanini bilish uchun
+current_handler = contextvars.ContextVar('current_handler', default='background')
+# Joriy update uchun Firestore RPC/o'qish/yozish hisobi (/perf uchun)
+current_interaction = contextvars.ContextVar('current_interaction', default=None)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = defaultdict(float)
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] += amount
+
+    def samples(self):
+        for label_values, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.labels, label_values)} {value:g}"
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *label_values, amount=1):
+        self.values[label_values] -= amount
+
+    def set(self, *label_values, value):
+        self.values[label_values] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, *label_values, value):
+        buckets, count, total = self.values.get(label_values, ([0] * len(self.buckets), 0, 0.0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                buckets[i] += 1
+        self.values[label_values] = (buckets, count + 1, total + value)
+
+    def samples(self):
+        for label_values, (buckets, count, total) in sorted(self.values.items()):
+            for bound, in_bucket in zip(self.buckets, buckets):
+                yield f"{self.name}_bucket{_labels(self.labels, label_values, [('le', f'{bound:g}')])} {in_bucket}"
+            yield f"{self.name}_bucket{_labels(self.labels, label_values, [('le', '+Inf')])} {count}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {total:g}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {count}"
+
+
+handler_latency = Histogram(
+    'bot_handler_duration_seconds', "Handler bajarilish vaqti", ('handler',)
+)
+handler_errors = Counter('bot_handler_errors_total', "Xato bilan tugagan handlerlar", ('handler',))
+updates_in_flight = Gauge('bot_updates_in_flight', "Hozir bajarilayotgan update lar", ('handler',))
+firestore_ops = Counter(
+    'bot_firestore_operations_total', "Firestore hujjat o'qish/yozishlari", ('handler', 'op')
+)
+firestore_errors = Counter('bot_firestore_errors_total', "Firestore RPC xatolari", ('rpc',))
+telegram_calls = Counter(
+    'bot_telegram_api_calls_total', "Telegram Bot API chaqiruvlari", ('method', 'result')
+)
+code_pool_depth = Gauge('bot_code_pool_depth', "Promo kod poolidagi tayyor kodlar")
+code_pool_codes = Counter(
+    'bot_code_pool_codes_total', "Pool kodlari: claimed (berildi), fallback (pool bo'sh), refilled", ('event',)
+)
+promo_api_requests = Counter(
+    'bot_promo_api_requests_total', "Promo kod API so'rovlari", ('endpoint', 'status')
+)
+
+REGISTRY = [
+    handler_latency, handler_errors, updates_in_flight, firestore_ops, firestore_errors, telegram_calls,
+    code_pool_depth, code_pool_codes, promo_api_requests,
+]
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+# ============================================================
+# SO'NGGI INTERAKSIYALAR (/perf)
+# ============================================================
+
+PERF_BUFFER_SIZE = 20000
+
+# (vaqt, handler, davomiylik, rpc, o'qish, yozish)
+recent_interactions = deque(maxlen=PERF_BUFFER_SIZE)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def perf_summary(minutes):
+    """Oxirgi `minutes` daqiqa uchun handlerlar bo'yicha: soni, p50/p95/p99, o'rtacha RPC"""
+    since = time.time() - minutes * 60
+    grouped = defaultdict(list)
+    for entry in reversed(recent_interactions):
+        if entry[0] < since:
+            break
+        grouped[entry[1]].append(entry)
+        grouped['*'].append(entry)
+
+    summary = {}
+    for name, entries in grouped.items():
+        durations = sorted(entry[2] for entry in entries)
+        summary[name] = {
+            'count': len(entries),
+            'p50': percentile(durations, 0.50),
+            'p95': percentile(durations, 0.95),
+            'p99': percentile(durations, 0.99),
+            'rpcs': sum(entry[3] for entry in entries) / len(entries),
+            'reads': sum(entry[4] for entry in entries) / len(entries),
+            'writes': sum(entry[5] for entry in entries) / len(entries),
+        }
+    return summary
+
+
+def _count_firestore(field, amount=1):
+    interaction = current_interaction.get()
+    if interaction is not None:
+        interaction[field] += amount
+
+
+# ============================================================
+# INSTRUMENTATION HOOK
+# ============================================================
+
+def instrumented(func=None, *, label=None):
+    """Handler vaqti, xatolari va in-flight sonini yozish.
+
+    label(update) berilsa metrika nomi update dan olinadi (masalan admin_* callbacklar uchun).
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            name = label(update) if label else handler.__name__
+            interaction = {'rpcs': 0, 'reads': 0, 'writes': 0}
+            token = current_handler.set(name)
+            interaction_token = current_interaction.set(interaction)
+            updates_in_flight.inc(name)
+            started = time.perf_counter()
+            try:
+                return await handler(update, context)
+            except Exception:
+                handler_errors.inc(name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                handler_latency.observe(name, value=elapsed)
+                recent_interactions.append((
+                    time.time(), name, elapsed,
+                    interaction['rpcs'], interaction['reads'], interaction['writes'],
+                ))
+                updates_in_flight.dec(name)
+                current_interaction.reset(interaction_token)
+                current_handler.reset(token)
+        return wrapper
+
+    return decorator(func) if func else decorator
+
+
+async def _count_stream(stream, field, handler):
+    async for response in stream:
+        if field in response:
+            firestore_ops.inc(handler, 'read')
+            _count_firestore('reads')
+        yield response
+
+
+def _wrap_firestore_api(api):
+    def wrap_stream(rpc, field):
+        original = getattr(api, rpc)
+
+        async def call(*args, **kwargs):
+            _count_firestore('rpcs')
+            try:
+                stream = await original(*args, **kwargs)
+            except Exception:
+                firestore_errors.inc(rpc)
+                raise
+            return _count_stream(stream, field, current_handler.get())
+
+        setattr(api, rpc, call)
+
+    original_commit = api.commit
+
+    async def commit(*args, **kwargs):
+        _count_firestore('rpcs')
+        try:
+            response = await original_commit(*args, **kwargs)
+        except Exception:
+            firestore_errors.inc('commit')
+            raise
+        firestore_ops.inc(current_handler.get(), 'write', amount=len(response.write_results))
+        _count_firestore('writes', len(response.write_results))
+        return response
+
+    wrap_stream('batch_get_documents', 'found')
+    wrap_stream('run_query', 'document')
+    wrap_stream('run_aggregation_query', 'result')
+    api.commit = commit
+
+
+def instrument_firestore(client):
+    """AsyncClient ning GAPIC qatlamida o'qish/yozishlarni sanash.
+
+    GAPIC klient birinchi so'rovda (event loop ichida) yaratiladi, shuning uchun
+    o'rash ham o'sha paytda bajariladi.
+    """
+    helper = client._firestore_api_helper
+
+    def instrumented_helper(*args, **kwargs):
+        api = helper(*args, **kwargs)
+        if not getattr(api, '_bot_metrics', False):
+            _wrap_firestore_api(api)
+            api._bot_metrics = True
+        return api
+
+    client._firestore_api_helper = instrumented_helper
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """Bot API chaqiruvlarini metod va natija bo'yicha sanash"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            telegram_calls.inc(api_method, type(e).__name__)
+            raise
+        telegram_calls.inc(api_method, 'ok' if code == 200 else str(code))
+        return code, payload
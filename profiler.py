@@ -0,0 +1,80 @@
+import os
+import signal
+import asyncio
+from collections import Counter
+
+
+# ============================================================
+# SAMPLING PROFILER (/perf profile)
+# ============================================================
+#
+# SIGPROF har PROFILE_INTERVAL soniya CPU vaqtida main thread (event loop) stekini yozadi.
+# Faqat CPU ishlatilgan paytlar namunalanadi, shuning uchun Firestore/Telegram kutishlari
+# hisobotga tushmaydi - issiq funksiyalar ko'rinadi. Deploy va kod o'zgarishi kerak emas.
+
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 60
+PROFILE_TOP = 40
+
+_active = False
+
+
+def _frame_key(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def format_profile(own, total, samples, seconds):
+    cpu_seconds = samples * PROFILE_INTERVAL
+    lines = [
+        f"Sampling profile: {seconds} s, {samples} ta namuna, interval {PROFILE_INTERVAL * 1000:g} ms",
+        f"CPU vaqti: ~{cpu_seconds:.2f} s ({cpu_seconds / seconds * 100:.1f}%)",
+        "",
+        f"=== Eng ko'p CPU olgan funksiyalar (o'zi) - top {PROFILE_TOP} ===",
+    ]
+    for key, count in own.most_common(PROFILE_TOP):
+        lines.append(f"{count:8d}  {count / samples * 100:6.2f}%  {key}")
+    lines += ["", f"=== Stekda qatnashgan (kumulyativ) - top {PROFILE_TOP} ==="]
+    for key, count in total.most_common(PROFILE_TOP):
+        lines.append(f"{count:8d}  {count / samples * 100:6.2f}%  {key}")
+    return '\n'.join(lines) + '\n'
+
+
+async def profile_event_loop(seconds):
+    """Event loop ni `seconds` soniya namunalab, hisobot matnini qaytarish (main thread dan)"""
+    global _active
+    if not hasattr(signal, 'setitimer'):
+        raise RuntimeError("Profiler faqat Linux/macOS da ishlaydi")
+    if _active:
+        raise RuntimeError("Profiler allaqachon ishlayapti")
+
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    own, total = Counter(), Counter()
+    samples = 0
+
+    def on_sample(signum, frame):
+        nonlocal samples
+        if frame is None:
+            return
+        samples += 1
+        own[_frame_key(frame.f_code)] += 1
+        seen = set()
+        while frame is not None:
+            key = _frame_key(frame.f_code)
+            if key not in seen:
+                total[key] += 1
+                seen.add(key)
+            frame = frame.f_back
+
+    _active = True
+    previous = signal.signal(signal.SIGPROF, on_sample)
+    signal.setitimer(signal.ITIMER_PROF, PROFILE_INTERVAL, PROFILE_INTERVAL)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous)
+        _active = False
+
+    if not samples:
+        return f"Sampling profile: {seconds} s - CPU deyarli ishlatilmadi, namuna yo'q.\n"
+    return format_profile(own, total, samples, seconds)
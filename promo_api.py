@@ -0,0 +1,258 @@
+import os
+import hmac
+import json
+import time
+import asyncio
+from datetime import datetime, timezone
+from webserver import text_response
+from metrics import current_handler, promo_api_requests
+from promo_codes import PROMO_CODE_CHARS, PROMO_CODE_LENGTH
+from repository import get_promo_code, redeem_promo_code, save_redemption_audit
+
+
+# ============================================================
+# PROMO KOD API (TDM Training ilovasi)
+# ============================================================
+#
+# Health server bilan bitta portda:
+#   POST /api/promo/validate  {"code"}             -> kod holati (ishlatmasdan)
+#   POST /api/promo/redeem    {"code", "user_id"}  -> atomar ishlatish (used/used_by)
+# Header: Authorization: Bearer <PROMO_API_KEY>. Kalit o'rnatilmagan bo'lsa API yoqilmaydi.
+#
+# Narx: ishlatish = 1 o'qish + 1 yozish. Mavjud bo'lmagan va ishlatilgan kodlar keshdan
+# javob oladi (Firestore ga bormaydi), audit yozuvlari batch bilan yoziladi.
+
+PROMO_API_KEY = os.getenv("PROMO_API_KEY", "")
+
+# Mavjud bo'lmagan kod shu muddat qayta so'ralmaydi
+INVALID_CODE_TTL = int(os.getenv("INVALID_CODE_TTL", 600))
+CODE_CACHE_MAX_SIZE = 100000
+
+# Oynadagi muvaffaqiyatsiz urinishlar chegarasi: har bir end-user (user_id) uchun va chaqiruvchi
+# (IP) uchun alohida. API ni ilova serverlari chaqiradi - ularning barcha userlari bitta IP dan
+# keladi, shuning uchun IP chegarasi ancha baland (0 - o'chirilgan). user_id ni chaqiruvchi o'zi
+# yuboradi, IP chegarasi esa uni almashtirib turib kod terishni cheklaydi.
+REDEEM_MAX_FAILURES = int(os.getenv("REDEEM_MAX_FAILURES", 10))
+REDEEM_MAX_CALLER_FAILURES = int(os.getenv("REDEEM_MAX_CALLER_FAILURES", 1000))
+REDEEM_FAILURE_WINDOW = int(os.getenv("REDEEM_FAILURE_WINDOW", 600))
+CLIENT_TABLE_MAX_SIZE = 100000
+# X-Forwarded-For faqat shu manzillardan (proxy/load balancer) kelganda hisobga olinadi
+TRUSTED_PROXIES = {ip.strip() for ip in os.getenv("TRUSTED_PROXIES", "").split(',') if ip.strip()}
+
+AUDIT_FLUSH_INTERVAL = 5
+AUDIT_BATCH_SIZE = 400
+AUDIT_QUEUE_MAX_SIZE = 50000
+
+# Status -> HTTP kod
+HTTP_STATUS = {
+    'valid': 200,
+    'redeemed': 200,
+    'invalid': 404,
+    'not_found': 404,
+    'already_used': 409,
+}
+FAILED_STATUSES = {'invalid', 'not_found', 'already_used'}
+
+# kod -> amal qilish muddati
+_invalid_codes = {}
+# kod -> {'coins', 'used_by'}: ishlatilgan kod qaytib bo'shamaydi
+_used_codes = {}
+# "ip:..." / "user:..." -> (xatolar soni, oyna boshlangan vaqt); tartib = oyna boshlanishi
+_failures = {}
+_audit_queue = []
+
+
+def _json(payload, status=200):
+    return text_response(json.dumps(payload), status, content_type="application/json")
+
+
+def normalize_code(code):
+    code = str(code or '').strip().upper()
+    if len(code) != PROMO_CODE_LENGTH or any(ch not in PROMO_CODE_CHARS for ch in code):
+        return None
+    return code
+
+
+def client_ip(request):
+    """Mijoz IP si: X-Forwarded-For faqat ishonchli proxy dan kelsa, o'ngdan birinchi begona manzil"""
+    if request.remote not in TRUSTED_PROXIES:
+        return request.remote
+    forwarded = [ip.strip() for ip in request.headers.get('x-forwarded-for', '').split(',') if ip.strip()]
+    for ip in reversed(forwarded):
+        if ip not in TRUSTED_PROXIES:
+            return ip
+    return request.remote
+
+
+def _limit_keys(request, user_id):
+    """(kalit, chegara) juftlari: chaqiruvchi IP si va (berilsa) end-user"""
+    keys = []
+    if REDEEM_MAX_CALLER_FAILURES:
+        keys.append((f"ip:{client_ip(request)}", REDEEM_MAX_CALLER_FAILURES))
+    if user_id:
+        keys.append((f"user:{user_id}", REDEEM_MAX_FAILURES))
+    return keys
+
+
+def _retry_after(keys):
+    """Chegaradan oshgan kalitlar uchun eng uzoq kutish vaqti (soniya), aks holda 0"""
+    now = time.monotonic()
+    retry_after = 0
+    for key, limit in keys:
+        count, started = _failures.get(key, (0, 0))
+        remaining = started + REDEEM_FAILURE_WINDOW - now
+        if count >= limit and remaining > 0:
+            retry_after = max(retry_after, int(remaining) + 1)
+    return retry_after
+
+
+def _record_failure(keys):
+    now = time.monotonic()
+    for key, _ in keys:
+        count, started = _failures.get(key, (0, now))
+        if started + REDEEM_FAILURE_WINDOW <= now:
+            # Yangi oyna - kalit oxiriga o'tadi, jadval oyna boshlanishi bo'yicha tartibda qoladi
+            del _failures[key]
+            count, started = 0, now
+        elif key not in _failures:
+            # To'lsa eng eski oynalar chiqariladi (jazolarni to'liq tozalab bo'lmaydi)
+            while len(_failures) >= CLIENT_TABLE_MAX_SIZE:
+                del _failures[next(iter(_failures))]
+        _failures[key] = (count + 1, started)
+
+
+def _remember(cache, code, value):
+    if len(cache) >= CODE_CACHE_MAX_SIZE:
+        cache.clear()
+    cache[code] = value
+
+
+def _cached_result(code, user_id=None):
+    """Keshdan javob: (status, coins) yoki None (Firestore ga borish kerak)"""
+    expires = _invalid_codes.get(code)
+    if expires and expires > time.monotonic():
+        return 'not_found', None
+    used = _used_codes.get(code)
+    if used:
+        status = 'redeemed' if user_id and used['used_by'] == user_id else 'already_used'
+        return status, used['coins']
+    return None
+
+
+def _store_result(code, status, data):
+    if status == 'not_found':
+        _remember(_invalid_codes, code, time.monotonic() + INVALID_CODE_TTL)
+    elif data and data.get('used'):
+        _remember(_used_codes, code, {'coins': data.get('coins'), 'used_by': data.get('used_by')})
+
+
+async def _lookup(code):
+    data = await get_promo_code(code)
+    if data is None:
+        return 'not_found', None
+    return ('already_used' if data.get('used') else 'valid'), data
+
+
+async def _handle(request, endpoint):
+    auth = request.headers.get('authorization', '')
+    # str ni compare_digest faqat ASCII da qabul qiladi - baytlar solishtiriladi
+    if not hmac.compare_digest(auth.encode(), f"Bearer {PROMO_API_KEY}".encode()):
+        promo_api_requests.inc(endpoint, 'unauthorized')
+        return _json({'ok': False, 'status': 'unauthorized'}, 401)
+    try:
+        payload = json.loads(request.body or b'{}')
+        if not isinstance(payload, dict):
+            raise ValueError
+    except ValueError:
+        promo_api_requests.inc(endpoint, 'bad_request')
+        return _json({'ok': False, 'status': 'bad_request'}, 400)
+
+    user_id = str(payload['user_id']) if payload.get('user_id') else None
+    if endpoint == 'redeem' and not user_id:
+        promo_api_requests.inc(endpoint, 'bad_request')
+        return _json({'ok': False, 'status': 'bad_request', 'error': "user_id kerak"}, 400)
+
+    limit_keys = _limit_keys(request, user_id)
+    retry_after = _retry_after(limit_keys)
+    if retry_after:
+        promo_api_requests.inc(endpoint, 'rate_limited')
+        return _json({'ok': False, 'status': 'rate_limited', 'retry_after': retry_after}, 429)
+
+    code = normalize_code(payload.get('code'))
+    coins = None
+    if code is None:
+        status = 'invalid'
+    else:
+        cached = _cached_result(code, user_id)
+        if cached:
+            status, coins = cached
+        else:
+            token = current_handler.set(f"promo_api_{endpoint}")
+            try:
+                if endpoint == 'redeem':
+                    status, data = await redeem_promo_code(code, user_id)
+                else:
+                    status, data = await _lookup(code)
+            finally:
+                current_handler.reset(token)
+            _store_result(code, status, data)
+            coins = data.get('coins') if data else None
+
+    if status in FAILED_STATUSES:
+        _record_failure(limit_keys)
+    promo_api_requests.inc(endpoint, status)
+    _audit(endpoint, code or str(payload.get('code', ''))[:32], user_id, client_ip(request), status)
+
+    response = {'ok': status in ('valid', 'redeemed'), 'status': status}
+    if response['ok']:
+        response['coins'] = coins
+    return _json(response, HTTP_STATUS[status])
+
+
+# ============================================================
+# AUDIT (promo_redemptions)
+# ============================================================
+
+def _audit(endpoint, code, user_id, client, status):
+    if len(_audit_queue) >= AUDIT_QUEUE_MAX_SIZE:
+        del _audit_queue[:AUDIT_BATCH_SIZE]
+    _audit_queue.append({
+        'endpoint': endpoint,
+        'code': code,
+        'user_id': user_id,
+        'client': client,
+        'status': status,
+        'requested_at': datetime.now(timezone.utc),
+    })
+
+
+async def flush_audit():
+    """Navbatdagi audit yozuvlarini batchlab yozish (xato bo'lsa navbatga qaytadi)"""
+    while _audit_queue:
+        entries = _audit_queue[:AUDIT_BATCH_SIZE]
+        del _audit_queue[:AUDIT_BATCH_SIZE]
+        try:
+            await save_redemption_audit(entries)
+        except Exception as e:
+            print(f"[PROMO API] Audit yozishda xato: {e}")
+            _audit_queue[:0] = entries
+            return
+
+
+async def audit_worker(interval=AUDIT_FLUSH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        await flush_audit()
+
+
+def promo_api_routes():
+    async def validate(request):
+        return await _handle(request, 'validate')
+
+    async def redeem(request):
+        return await _handle(request, 'redeem')
+
+    return {
+        ('POST', '/api/promo/validate'): validate,
+        ('POST', '/api/promo/redeem'): redeem,
+    }
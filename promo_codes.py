@@ -0,0 +1,43 @@
+import string
+import random
+import hashlib
+
+
+# ============================================================
+# PROMO KOD SXEMASI
+# ============================================================
+#
+# Kodlar ketma-ket raqamdan kalitli Feistel almashtirish orqali olinadi:
+# har bir raqam boshqa kodga o'tadi (takrorlanmaydi), lekin kodlarni taxmin qilib bo'lmaydi.
+
+PROMO_CODE_CHARS = string.ascii_uppercase + string.digits
+PROMO_CODE_LENGTH = 8
+PROMO_CODE_SPACE = len(PROMO_CODE_CHARS) ** PROMO_CODE_LENGTH
+PROMO_CODE_HALF = len(PROMO_CODE_CHARS) ** (PROMO_CODE_LENGTH // 2)
+PROMO_CODE_ROUNDS = 4
+
+
+def random_promo_code(length=PROMO_CODE_LENGTH):
+    return ''.join(random.choices(PROMO_CODE_CHARS, k=length))
+
+
+def permute_code_number(number, key):
+    """[0, 36^8) oralig'idagi raqamni kalit bo'yicha shu oraliqdagi boshqa raqamga o'tkazish"""
+    left, right = divmod(number, PROMO_CODE_HALF)
+    for i in range(PROMO_CODE_ROUNDS):
+        digest = hashlib.blake2b(f"{i}:{right}".encode(), key=key, digest_size=8).digest()
+        left, right = right, (left + int.from_bytes(digest, 'big')) % PROMO_CODE_HALF
+    return left * PROMO_CODE_HALF + right
+
+
+def encode_promo_code(number):
+    chars = []
+    for _ in range(PROMO_CODE_LENGTH):
+        number, index = divmod(number, len(PROMO_CODE_CHARS))
+        chars.append(PROMO_CODE_CHARS[index])
+    return ''.join(reversed(chars))
+
+
+def promo_code_for(number, key):
+    """Ketma-ket raqam -> 8 belgili promo kod"""
+    return encode_promo_code(permute_code_number(number, key))
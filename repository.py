@@ -0,0 +1,1084 @@
+import os
+import json
+import time
+import random
+import socket
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+import firebase_admin
+from firebase_admin import credentials, firestore, firestore_async
+from google.api_core.exceptions import Conflict
+from google.auth.credentials import AnonymousCredentials
+from google.cloud.firestore import async_transactional
+from google.cloud.firestore_v1.base_query import FieldFilter
+from promo_codes import random_promo_code, promo_code_for
+from metrics import instrument_firestore, code_pool_depth, code_pool_codes
+
+
+# .env fayldan o'qish
+load_dotenv()
+
+
+# ============================================================
+# FIREBASE INIT
+# ============================================================
+
+class EmulatorCredential(credentials.Base):
+    """Firestore emulator uchun (benchmarklar) - haqiqiy kalit kerak emas"""
+
+    def get_credential(self):
+        return AnonymousCredentials()
+
+
+_firebase = {'client': None}
+_firebase_lock = threading.Lock()
+
+
+def init_firebase():
+    """Firebase ni birinchi kerak bo'lganda ishga tushirish (import vaqtida emas)"""
+    with _firebase_lock:
+        if _firebase['client'] is not None:
+            return _firebase['client']
+
+        firebase_creds_json = os.getenv("FIREBASE_CREDENTIALS")
+        if firebase_creds_json:
+            cred = credentials.Certificate(json.loads(firebase_creds_json))
+            firebase_admin.initialize_app(cred)
+        elif os.getenv("FIRESTORE_EMULATOR_HOST"):
+            firebase_admin.initialize_app(
+                EmulatorCredential(), {'projectId': os.getenv("GOOGLE_CLOUD_PROJECT", "tdm-bot-local")}
+            )
+        else:
+            firebase_admin.initialize_app(credentials.Certificate("service_account.json"))
+
+        client = firestore_async.client()
+        instrument_firestore(client)
+        _firebase['client'] = client
+        return client
+
+
+class _LazyAsyncClient:
+    """adb.collection(...) kabi murojaatda Firebase ni ishga tushiradigan o'rinbosar"""
+
+    def __getattr__(self, name):
+        return getattr(init_firebase(), name)
+
+
+# Handlerlar faqat async client orqali ishlaydi - event loop bloklanmaydi
+adb = _LazyAsyncClient()
+
+
+# ============================================================
+# SOZLAMALAR (bot_config) - xotiradagi kesh
+# ============================================================
+
+# Listener ishlamay qolsa, kesh shuncha soniyadan keyin qayta o'qiladi
+CONFIG_CACHE_TTL = int(os.getenv("CONFIG_CACHE_TTL", 60))
+
+_config = {'channels': None, 'task_version': None, 'promo_coins': None, 'requests_migrated': False}
+_config_loaded_at = {'channels': 0.0, 'settings': 0.0}
+_config_watches = {}
+
+
+def _apply_channels(data):
+    _config['channels'] = (data or {}).get('list', [])
+    _config_loaded_at['channels'] = time.monotonic()
+
+
+def _apply_settings(data):
+    data = data or {}
+    _config['task_version'] = data.get('task_version', 1)
+    _config['promo_coins'] = data.get('promo_coins')
+    _config['requests_migrated'] = data.get('requests_migrated', False)
+    _config_loaded_at['settings'] = time.monotonic()
+
+
+def _is_fresh(name):
+    if not _config_loaded_at[name]:
+        return False
+    watch = _config_watches.get(name)
+    if watch is not None and watch.is_active:
+        return True
+    return time.monotonic() - _config_loaded_at[name] < CONFIG_CACHE_TTL
+
+
+def _on_channels_snapshot(docs, changes, read_time):
+    _apply_channels(docs[0].to_dict() if docs else None)
+
+
+def _on_settings_snapshot(docs, changes, read_time):
+    _apply_settings(docs[0].to_dict() if docs else None)
+
+
+def start_config_listener():
+    """bot_config hujjatlarini on_snapshot orqali kuzatib, keshni yangilab turish"""
+    try:
+        init_firebase()
+        db = firestore.client()
+        config = db.collection('bot_config')
+        _config_watches['channels'] = config.document('channels').on_snapshot(_on_channels_snapshot)
+        _config_watches['settings'] = config.document('settings').on_snapshot(_on_settings_snapshot)
+        print("✅ Config listener ishga tushdi")
+    except Exception as e:
+        print(f"Config listener xatosi (TTL rejimida ishlaydi): {e}")
+
+
+async def get_channels():
+    if not _is_fresh('channels'):
+        try:
+            doc = await adb.collection('bot_config').document('channels').get()
+            _apply_channels(doc.to_dict() if doc.exists else None)
+        except Exception as e:
+            print(f"Kanallarni olishda xato: {e}")
+    return list(_config['channels'] or [])
+
+
+async def save_channels(channels):
+    await adb.collection('bot_config').document('channels').set({'list': channels})
+    _apply_channels({'list': list(channels)})
+
+
+async def _load_settings():
+    if not _is_fresh('settings'):
+        try:
+            doc = await adb.collection('bot_config').document('settings').get()
+            _apply_settings(doc.to_dict() if doc.exists else None)
+        except Exception as e:
+            print(f"Sozlamalarni olishda xato: {e}")
+
+
+async def warm_up():
+    """Firebase ni ishga tushirib, kanallar va sozlamalarni (task_version, promo_coins) parallel yuklash"""
+    await asyncio.to_thread(init_firebase)
+    await asyncio.gather(get_channels(), _load_settings())
+    return {
+        'channels': len(_config['channels'] or []),
+        'task_version': _config['task_version'],
+        'promo_coins': _config['promo_coins'],
+    }
+
+
+async def get_task_version():
+    await _load_settings()
+    return _config['task_version'] or 1
+
+
+async def get_promo_coins(default):
+    await _load_settings()
+    coins = _config['promo_coins']
+    return coins if coins is not None else default
+
+
+async def set_task_version(version):
+    await adb.collection('bot_config').document('settings').set(
+        {'task_version': version}, merge=True
+    )
+    _config['task_version'] = version
+
+
+async def set_promo_coins(amount):
+    await adb.collection('bot_config').document('settings').set(
+        {'promo_coins': amount}, merge=True
+    )
+    _config['promo_coins'] = amount
+
+
+# ============================================================
+# USER SO'ROVLARI
+# ============================================================
+#
+# Yangi model: bot_users/{uid}.progress = {"<versiya>": {kanal_id: requested_at}}
+# Eski user_requests kolleksiyasi faqat migratsiya tugaguncha yoziladi va o'qishda zaxira
+# sifatida ishlatiladi; keyin statistika faqat hisoblagichlardan olinadi.
+
+# Har bir (versiya, kanal) hisoblagichi shuncha shardga bo'linadi.
+# Jami = request_counters/{versiya}_{kanal}.base + shardlar yig'indisi; base migratsiyada
+# user_requests dagi count() dan to'ldiriladi (hisoblagichdan oldingi so'rovlar).
+REQUEST_COUNTER_SHARDS = 10
+
+
+def _request_counter(task_version, channel_id):
+    return adb.collection('request_counters').document(f"{task_version}_{channel_id}")
+
+
+def _request_counter_shard(task_version, channel_id, shard):
+    return _request_counter(task_version, channel_id).collection('shards').document(str(shard))
+
+
+@async_transactional
+async def _save_user_request(transaction, user_id, channel_id, task_version):
+    """Migratsiyadan keyin: progress + hisoblagich (qayta bosilsa hisoblagich oshmaydi)"""
+    user_ref = adb.collection('bot_users').document(str(user_id))
+    doc = await user_ref.get(transaction=transaction)
+    progress = ((doc.to_dict() if doc.exists else {}).get('progress') or {}).get(str(task_version)) or {}
+    if channel_id in progress:
+        return
+    fields = {
+        'telegram_uid': str(user_id),
+        'progress': {str(task_version): {channel_id: firestore.SERVER_TIMESTAMP}},
+    }
+    if not doc.exists:
+        # 'incomplete' segmenti (completed_version < versiya) bu userni ham topishi kerak
+        fields['completed_version'] = 0
+    transaction.set(user_ref, fields, merge=True)
+    shard = random.randrange(REQUEST_COUNTER_SHARDS)
+    transaction.set(_request_counter_shard(task_version, channel_id, shard), {
+        'count': firestore.Increment(1),
+    }, merge=True)
+
+
+async def save_user_request(user_id, channel_id, task_version, new_user=False):
+    """Userning so'rov yuborgan kanalini saqlash (new_user - bot_users hujjati hali yo'q)"""
+    try:
+        await _load_settings()
+        if _config['requests_migrated']:
+            await _save_user_request(adb.transaction(), user_id, channel_id, task_version)
+            return True
+
+        batch = adb.batch()
+        # create() - qayta bosilganda hisoblagich ikki marta oshmaydi
+        batch.create(adb.collection('user_requests').document(f"{user_id}_{channel_id}_{task_version}"), {
+            'user_id': str(user_id),
+            'channel_id': channel_id,
+            'task_version': task_version,
+            'requested_at': firestore.SERVER_TIMESTAMP,
+        })
+        fields = {
+            'telegram_uid': str(user_id),
+            'progress': {str(task_version): {channel_id: firestore.SERVER_TIMESTAMP}},
+        }
+        if new_user:
+            fields['completed_version'] = 0
+        batch.set(adb.collection('bot_users').document(str(user_id)), fields, merge=True)
+        shard = random.randrange(REQUEST_COUNTER_SHARDS)
+        batch.set(_request_counter_shard(task_version, channel_id, shard), {
+            'count': firestore.Increment(1),
+        }, merge=True)
+        await batch.commit()
+        return True
+    except Conflict:
+        # So'rov allaqachon saqlangan
+        return True
+    except Exception as e:
+        print(f"So'rovni saqlashda xato: {e}")
+        return False
+
+
+async def get_user_request_state(user_id, task_version, channels):
+    """User so'rov yuborgan kanallar ID larini bitta get_all chaqiruvi bilan olish"""
+    request_channels = [ch for ch in channels if ch.get('type') == 'request']
+    if not request_channels:
+        return set()
+
+    doc_ids = {f"{user_id}_{ch['id']}_{task_version}": ch['id'] for ch in request_channels}
+    refs = [adb.collection('user_requests').document(doc_id) for doc_id in doc_ids]
+    try:
+        docs = [doc async for doc in adb.get_all(refs)]
+    except Exception as e:
+        print(f"So'rovlarni tekshirishda xato: {e}")
+        return set()
+    return {doc_ids[doc.id] for doc in docs if doc.exists}
+
+
+async def get_user_progress(user_id, task_version, channels):
+    """bot_users hujjati va joriy versiyada so'rov yuborilgan kanallar (bitta o'qish)"""
+    try:
+        doc = await adb.collection('bot_users').document(str(user_id)).get()
+    except Exception as e:
+        print(f"User progressini olishda xato: {e}")
+        return None, set()
+
+    data = doc.to_dict() if doc.exists else None
+    progress = ((data or {}).get('progress') or {}).get(str(task_version), {})
+    request_channels = [ch for ch in channels if ch.get('type') == 'request']
+    requested = {ch['id'] for ch in request_channels if ch['id'] in progress}
+
+    # Migratsiya tugamagan bo'lsa - eski user_requests hujjatlaridan ham o'qish
+    await _load_settings()
+    missing = [ch for ch in request_channels if ch['id'] not in requested]
+    if missing and not _config['requests_migrated']:
+        requested |= await get_user_request_state(user_id, task_version, missing)
+
+    return data, requested
+
+
+async def backfill_user_progress(page_size=400):
+    """Eski user_requests hujjatlarini bot_users.progress ga ko'chirish"""
+    migrated = 0
+    last_doc = None
+    # Uchragan (versiya, kanal) juftlari - ularning hisoblagichlari oxirida to'ldiriladi
+    counter_keys = set()
+    while True:
+        query = adb.collection('user_requests').order_by('__name__').limit(page_size)
+        if last_doc is not None:
+            query = query.start_after(last_doc)
+        docs = [doc async for doc in query.stream()]
+        if not docs:
+            break
+
+        progress_by_user = {}
+        for doc in docs:
+            data = doc.to_dict()
+            uid = data.get('user_id')
+            channel_id = data.get('channel_id')
+            version = data.get('task_version')
+            if not uid or channel_id is None or version is None:
+                continue
+            counter_keys.add((version, channel_id))
+            user_progress = progress_by_user.setdefault(uid, {}).setdefault(str(version), {})
+            user_progress[channel_id] = data.get('requested_at') or firestore.SERVER_TIMESTAMP
+
+        users = adb.collection('bot_users')
+        refs = [users.document(uid) for uid in progress_by_user]
+        existing = {doc.id async for doc in adb.get_all(refs, field_paths=[]) if doc.exists}
+
+        batch = adb.batch()
+        for uid, progress in progress_by_user.items():
+            fields = {'telegram_uid': uid, 'progress': progress}
+            if uid not in existing:
+                fields['completed_version'] = 0
+            batch.set(users.document(uid), fields, merge=True)
+        await batch.commit()
+
+        migrated += len(docs)
+        last_doc = docs[-1]
+        print(f"[MIGRATE] {migrated} ta so'rov ko'chirildi")
+        if len(docs) < page_size:
+            break
+
+    seeded = 0
+    for task_version, channel_id in sorted(counter_keys):
+        if await _seed_request_counter(adb.transaction(), task_version, channel_id):
+            seeded += 1
+    print(f"[MIGRATE] {seeded} ta hisoblagich to'ldirildi")
+
+    await adb.collection('bot_config').document('settings').set(
+        {'requests_migrated': True}, merge=True
+    )
+    _config['requests_migrated'] = True
+    return migrated
+
+
+async def count_user_requests(user_id, user_data):
+    """Userning barcha versiyalardagi so'rovlari soni"""
+    await _load_settings()
+    if _config['requests_migrated']:
+        progress = (user_data or {}).get('progress') or {}
+        return sum(len(channels) for channels in progress.values())
+    return await count_documents('user_requests', [('user_id', '==', str(user_id))])
+
+
+async def _request_counter_totals():
+    """{versiya: so'rovlar} - barcha hisoblagichlar (base + shardlar) bitta get_all da.
+
+    list_documents() shardi bor, lekin o'zi yozilmagan (seed qilinmagan) hisoblagichlarni ham
+    qaytaradi; collection group so'rovi va qo'shimcha indeks kerak emas.
+    """
+    fields = {}
+    async for counter in adb.collection('request_counters').list_documents():
+        version = counter.id.split('_', 1)[0]
+        fields[counter.path] = (version, 'base')
+        for shard in range(REQUEST_COUNTER_SHARDS):
+            fields[counter.collection('shards').document(str(shard)).path] = (version, 'count')
+    totals = {}
+    if fields:
+        async for doc in adb.get_all([adb.document(path) for path in fields]):
+            if doc.exists:
+                version, field = fields[doc.reference.path]
+                totals[version] = totals.get(version, 0) + (doc.to_dict().get(field) or 0)
+    return totals
+
+
+async def get_request_totals(task_version):
+    """(jami so'rovlar, shu versiyadagi so'rovlar) - migratsiyadan keyin hisoblagichlardan"""
+    await _load_settings()
+    if not _config['requests_migrated']:
+        return tuple(await asyncio.gather(
+            count_documents('user_requests'),
+            count_documents('user_requests', [('task_version', '==', task_version)]),
+        ))
+
+    totals = await _request_counter_totals()
+    return sum(totals.values()), totals.get(str(task_version), 0)
+
+
+@async_transactional
+async def _seed_request_counter(transaction, task_version, channel_id):
+    """Hisoblagich base ini bir marta user_requests dagi count() dan to'ldirish.
+
+    Shardlar va count() bitta tranzaksiyada o'qiladi: base + shardlar = count().
+    """
+    counter_ref = _request_counter(task_version, channel_id)
+    counter = await counter_ref.get(transaction=transaction)
+    if counter.exists and counter.to_dict().get('seeded'):
+        return False
+
+    refs = [_request_counter_shard(task_version, channel_id, shard) for shard in range(REQUEST_COUNTER_SHARDS)]
+    counted = 0
+    async for doc in adb.get_all(refs, transaction=transaction):
+        if doc.exists:
+            counted += doc.to_dict().get('count') or 0
+    query = adb.collection('user_requests').where(
+        filter=FieldFilter('task_version', '==', task_version)
+    ).where(filter=FieldFilter('channel_id', '==', channel_id))
+    result = await query.count().get(transaction=transaction)
+    total = result[0][0].value
+
+    transaction.set(counter_ref, {
+        'task_version': task_version,
+        'channel_id': channel_id,
+        'base': total - counted,
+        'seeded': True,
+    }, merge=True)
+    return True
+
+
+async def get_request_counts(task_version, channel_ids):
+    """Kanallar bo'yicha so'rovlar soni: {kanal_id: son}.
+
+    Migratsiyagacha manba faqat user_requests (count()), keyin esa faqat hisoblagichlar -
+    base va barcha shardlar bitta get_all da. Ikki manba aralashtirilmaydi.
+    """
+    await _load_settings()
+    if not _config['requests_migrated']:
+        counts = await asyncio.gather(*(
+            count_documents('user_requests', [
+                ('task_version', '==', task_version),
+                ('channel_id', '==', channel_id),
+            ])
+            for channel_id in channel_ids
+        ))
+        return dict(zip(channel_ids, counts))
+
+    fields = {}
+    for channel_id in channel_ids:
+        fields[_request_counter(task_version, channel_id).path] = (channel_id, 'base')
+        for shard in range(REQUEST_COUNTER_SHARDS):
+            fields[_request_counter_shard(task_version, channel_id, shard).path] = (channel_id, 'count')
+    counts = {channel_id: 0 for channel_id in channel_ids}
+    async for doc in adb.get_all([adb.document(path) for path in fields]):
+        if doc.exists:
+            channel_id, field = fields[doc.reference.path]
+            counts[channel_id] += doc.to_dict().get(field) or 0
+    return counts
+
+
+# ============================================================
+# FOYDALANUVCHILAR (bot_users)
+# ============================================================
+
+async def get_bot_user(user_id):
+    """bot_users hujjatini dict ko'rinishida qaytarish (yo'q bo'lsa None)"""
+    doc = await adb.collection('bot_users').document(str(user_id)).get()
+    if doc.exists:
+        return doc.to_dict()
+    return None
+
+
+async def get_page(query, page_size, cursor=None, backward=False):
+    """Cursor bilan bitta sahifa: (hujjatlar, oldingi_bor, keyingi_bor).
+
+    cursor - query tartibidagi maydonlar qiymati (dict). Bitta so'rov, page_size + 1 ta
+    hujjat: ortiqchasi shu yo'nalishda yana sahifa borligini bildiradi va ko'rsatilmaydi.
+    """
+    if backward:
+        docs = await query.end_before(cursor).limit_to_last(page_size + 1).get()
+        if len(docs) > page_size:
+            return docs[1:], True, True
+        return docs, False, True
+
+    if cursor:
+        query = query.start_after(cursor)
+    docs = [doc async for doc in query.limit(page_size + 1).stream()]
+    return docs[:page_size], cursor is not None, len(docs) > page_size
+
+
+async def get_recent_users_page(page_size, cursor=None, backward=False):
+    """Oxirgi faollik (updated_at) bo'yicha userlar. cursor = {'updated_at', '__name__'}"""
+    query = adb.collection('bot_users').order_by(
+        'updated_at', direction=firestore.Query.DESCENDING
+    ).order_by('__name__', direction=firestore.Query.DESCENDING)
+    return await get_page(query, page_size, cursor, backward)
+
+
+async def ensure_bot_user(user):
+    """Yangi user uchun bot_users hujjatini yaratish (mavjud bo'lsa tegmaydi)"""
+    try:
+        await adb.collection('bot_users').document(str(user.id)).create({
+            'telegram_uid': str(user.id),
+            'telegram_name': user.full_name,
+            'completed_version': 0,
+            'created_at': firestore.SERVER_TIMESTAMP,
+            # Admin "Userlar" ro'yxati updated_at bo'yicha tartiblanadi
+            'updated_at': firestore.SERVER_TIMESTAMP,
+        })
+    except Conflict:
+        pass
+    except Exception as e:
+        print(f"User yaratishda xato: {e}")
+
+
+# Broadcast segmentlari: nomi -> (tavsif, Firestore filtrlari)
+BROADCAST_SEGMENTS = {
+    'all': "Barcha foydalanuvchilar",
+    'incomplete': "Joriy versiyani bajarmaganlar",
+    'unused': "Ishlatilmagan promo kodi borlar",
+}
+
+
+def segment_filters(segment, task_version):
+    if segment == 'incomplete':
+        return [('completed_version', '<', task_version)]
+    if segment == 'unused':
+        return [('has_unused_code', '==', True)]
+    return []
+
+
+async def count_segment(segment, task_version):
+    return await count_documents('bot_users', segment_filters(segment, task_version))
+
+
+def _order_fields(filters):
+    # Tengsizlik filtri bo'lsa, birinchi tartiblash shu maydon bo'yicha bo'lishi shart
+    return [field for field, op, _ in filters if op != '==']
+
+
+def user_page_cursor(doc, segment='all', task_version=None):
+    """Sahifaning oxirgi hujjatidan saqlanadigan cursor: {'id', <tartib maydonlari>}.
+
+    Qiymatlar sahifa snapshotidan olinadi - hujjat keyin o'zgarsa (masalan user vazifani
+    bajarsa) ham keyingi sahifa to'g'ri joydan boshlanadi. '__name__' Firestore da maydon
+    nomi bo'la olmaydi, shuning uchun ID 'id' kaliti bilan saqlanadi.
+    """
+    cursor = {'id': doc.id}
+    for field in _order_fields(segment_filters(segment, task_version)):
+        cursor[field] = doc.get(field)
+    return cursor
+
+
+async def get_user_page(page_size, cursor=None, segment='all', task_version=None):
+    """bot_users ni segment filtri bilan sahifalab o'qish (cursor - user_page_cursor natijasi)"""
+    query = adb.collection('bot_users')
+    filters = segment_filters(segment, task_version)
+    for field, op, value in filters:
+        query = query.where(filter=FieldFilter(field, op, value))
+    order_fields = _order_fields(filters)
+    for field in order_fields:
+        query = query.order_by(field)
+    query = query.order_by('__name__').limit(page_size)
+
+    if cursor:
+        if isinstance(cursor, str):
+            # Eski joblar: cursor faqat hujjat ID si
+            cursor = {'id': cursor}
+        values = {field: cursor[field] for field in order_fields if field in cursor}
+        values['__name__'] = cursor['id']
+        query = query.start_after(values)
+    return [doc async for doc in query.stream()]
+
+
+async def sync_unused_code_flags():
+    """bot_users.has_unused_code ni promo_codes (used == False) bilan moslashtirish.
+
+    Bayroq yozish paytida yangilanadi (_issue_reward, _redeem_promo_code); to'liq skan faqat
+    /sync_code_flags bilan qo'lda ishga tushiriladi.
+    """
+    holders = set()
+    codes = adb.collection('promo_codes').where(filter=FieldFilter('used', '==', False))
+    async for doc in codes.select(['telegram_uid']).stream():
+        if doc.get('telegram_uid'):
+            holders.add(doc.get('telegram_uid'))
+
+    flagged = set()
+    users = adb.collection('bot_users')
+    async for doc in users.where(filter=FieldFilter('has_unused_code', '==', True)).select([]).stream():
+        flagged.add(doc.id)
+
+    changes = [(uid, True) for uid in holders - flagged] + [(uid, False) for uid in flagged - holders]
+    for i in range(0, len(changes), 400):
+        batch = adb.batch()
+        for uid, value in changes[i:i + 400]:
+            batch.set(users.document(uid), {'has_unused_code': value}, merge=True)
+        await batch.commit()
+    return len(changes)
+
+
+async def mark_user_inactive(user_id):
+    """Botni bloklagan user - keyingi broadcastlarda o'tkazib yuboriladi"""
+    await adb.collection('bot_users').document(str(user_id)).set({
+        'active': False,
+        'blocked_at': firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+
+
+# ============================================================
+# PROMO KODLAR (promo_codes)
+# ============================================================
+
+# Raqamlar bot_config/promo_counter dan bloklab band qilinadi (kod sxemasi: promo_codes.py).
+# Feistel kaliti faqat muhitdan (secret) olinadi: bot_config ni o'qiy oladiganlar (masalan
+# TDM Training ilovasi) ketma-ket raqamlardan berilgan kodlarni tiklay olmasligi kerak.
+# Eski o'rnatishlarda kalit bot_config/promo_counter.key da turgan - o'shani PROMO_CODE_KEY ga ko'chiring.
+
+PROMO_CODE_BLOCK_SIZE = int(os.getenv("PROMO_CODE_BLOCK_SIZE", 1000))
+PROMO_CODE_KEY = os.getenv("PROMO_CODE_KEY", "")
+
+_code_block = {'next': 0, 'end': 0}
+_code_block_lock = asyncio.Lock()
+
+
+def _promo_code_key():
+    """PROMO_CODE_KEY (hex, 16-64 bayt) - yo'q yoki noto'g'ri bo'lsa kod yaratilmaydi"""
+    try:
+        key = bytes.fromhex(PROMO_CODE_KEY)
+    except ValueError:
+        key = b''
+    if not 16 <= len(key) <= 64:
+        raise RuntimeError(
+            "PROMO_CODE_KEY o'rnatilmagan yoki noto'g'ri (16-64 bayt hex kerak: "
+            "python -c 'import secrets; print(secrets.token_hex(32))')"
+        )
+    return key
+
+
+@async_transactional
+async def _reserve_code_block(transaction, size):
+    ref = adb.collection('bot_config').document('promo_counter')
+    snapshot = await ref.get(transaction=transaction)
+    data = snapshot.to_dict() if snapshot.exists else {}
+    start = data.get('next', 0)
+    # Oldin shu yerda ochiq saqlangan kalit o'chiriladi
+    transaction.set(ref, {'next': start + size, 'key': firestore.DELETE_FIELD}, merge=True)
+    return start
+
+
+async def generate_promo_code():
+    """Yangi takrorlanmas kod (promo_codes dan o'qimasdan)"""
+    key = _promo_code_key()
+    async with _code_block_lock:
+        if _code_block['next'] >= _code_block['end']:
+            start = await _reserve_code_block(adb.transaction(), PROMO_CODE_BLOCK_SIZE)
+            _code_block.update(next=start, end=start + PROMO_CODE_BLOCK_SIZE)
+        number = _code_block['next']
+        _code_block['next'] += 1
+    return promo_code_for(number, key)
+
+
+def promo_code_data(code, user, task_version, coins):
+    return {
+        'code': code,
+        'telegram_uid': str(user.id),
+        'telegram_name': user.full_name,
+        'used': False,
+        'used_by': None,
+        'coins': coins,
+        'created_at': firestore.SERVER_TIMESTAMP,
+        'task_version': task_version,
+    }
+
+
+async def get_codes_page(used, page_size, cursor=None, backward=False):
+    """promo_codes ni kod (hujjat ID) bo'yicha sahifalash. cursor = {'__name__': kod}"""
+    query = adb.collection('promo_codes').where(filter=FieldFilter('used', '==', used)).order_by('__name__')
+    return await get_page(query, page_size, cursor, backward)
+
+
+async def get_codes_for_user(user_id):
+    query = adb.collection('promo_codes').where(filter=FieldFilter('telegram_uid', '==', str(user_id)))
+    return [doc async for doc in query.stream()]
+
+
+# ============================================================
+# STATISTIKA (server tomonida count())
+# ============================================================
+
+async def count_documents(collection, filters=()):
+    """Hujjatlarni yuklamasdan sanash: filters = [(maydon, operator, qiymat), ...]"""
+    query = adb.collection(collection)
+    for field, op, value in filters:
+        query = query.where(filter=FieldFilter(field, op, value))
+    result = await query.count().get()
+    return result[0][0].value
+
+
+# ============================================================
+# EKSPORT (sahifalab o'qish)
+# ============================================================
+
+async def iter_collection_pages(collection, filters=(), page_size=1000):
+    """Kolleksiyani __name__ bo'yicha sahifalab o'qish - xotirada faqat bitta sahifa turadi"""
+    query = adb.collection(collection)
+    for field, op, value in filters:
+        query = query.where(filter=FieldFilter(field, op, value))
+    query = query.order_by('__name__').limit(page_size)
+
+    last = None
+    while True:
+        page = query.start_after(last) if last else query
+        docs = [doc async for doc in page.stream()]
+        if docs:
+            yield docs
+        if len(docs) < page_size:
+            return
+        last = docs[-1]
+
+
+def _progress_rows(doc):
+    """bot_users.progress -> user_requests ko'rinishidagi qatorlar (id, ma'lumot)"""
+    progress = (doc.to_dict() or {}).get('progress') or {}
+    for version, channels in sorted(progress.items()):
+        for channel_id, requested_at in sorted((channels or {}).items()):
+            yield f"{doc.id}_{channel_id}_{version}", {
+                'user_id': doc.id,
+                'channel_id': channel_id,
+                'task_version': int(version) if str(version).isdigit() else version,
+                'requested_at': requested_at,
+            }
+
+
+async def iter_request_pages(filters=(), page_size=1000):
+    """So'rovlarni (id, ma'lumot) sahifalari bilan o'qish.
+
+    Migratsiyadan keyin user_requests yozilmaydi - qatorlar bot_users.progress dan yig'iladi,
+    filtrlar (faqat ==) shu qatorlarga qo'llanadi.
+    """
+    await _load_settings()
+    if not _config['requests_migrated']:
+        async for docs in iter_collection_pages('user_requests', filters, page_size):
+            yield [(doc.id, doc.to_dict()) for doc in docs]
+        return
+
+    def matches(row):
+        return all(row.get(field) == value for field, _, value in filters)
+
+    user_ids = {str(value) for field, _, value in filters if field == 'user_id'}
+
+    async def user_pages():
+        if len(user_ids) == 1:
+            # Bitta user - butun kolleksiya o'qilmaydi
+            doc = await adb.collection('bot_users').document(next(iter(user_ids))).get()
+            if doc.exists:
+                yield [doc]
+            return
+        async for docs in iter_collection_pages('bot_users', (), page_size):
+            yield docs
+
+    rows = []
+    async for docs in user_pages():
+        rows.extend(row for doc in docs for row in _progress_rows(doc) if matches(row[1]))
+        while len(rows) >= page_size:
+            yield rows[:page_size]
+            del rows[:page_size]
+    if rows:
+        yield rows
+
+
+# ============================================================
+# PROMO KOD POOLI (promo_code_pool)
+# ============================================================
+#
+# Kodlar fonda oldindan yaratiladi (kolliziya tekshiruvi shu yerda),
+# mukofot berishda esa bitta tranzaksiyada pooldan olinadi.
+
+CODE_POOL_TARGET = int(os.getenv("CODE_POOL_TARGET", 2000))
+CODE_POOL_LOW_WATERMARK = int(os.getenv("CODE_POOL_LOW_WATERMARK", 500))
+CODE_POOL_BATCH_SIZE = 400
+
+code_pool_stats = {'depth': None, 'claimed': 0, 'fallback': 0, 'refilled': 0}
+
+_refill_lock = asyncio.Lock()
+_background_tasks = set()
+
+
+def _set_pool_depth(depth):
+    code_pool_stats['depth'] = depth
+    code_pool_depth.set(value=depth)
+
+
+def _count_pool_event(event, amount=1):
+    code_pool_stats[event] += amount
+    code_pool_codes.inc(event, amount=amount)
+
+
+async def get_code_pool_depth():
+    _set_pool_depth(await count_documents('promo_code_pool'))
+    return code_pool_stats['depth']
+
+
+async def refill_code_pool(target=CODE_POOL_TARGET):
+    """Poolni target miqdorgacha to'ldirish, qo'shilgan kodlar sonini qaytaradi"""
+    if _refill_lock.locked():
+        return 0
+
+    async with _refill_lock:
+        pool = adb.collection('promo_code_pool')
+        depth = await get_code_pool_depth()
+        added = 0
+        while depth + added < target:
+            count = min(CODE_POOL_BATCH_SIZE, target - depth - added)
+            candidates = {await generate_promo_code() for _ in range(count)}
+
+            # Yangi kodlar o'zaro takrorlanmaydi, faqat eski tasodifiy kodlar bilan solishtiriladi
+            refs = [adb.collection('promo_codes').document(code) for code in candidates]
+            existing = {doc.id async for doc in adb.get_all(refs) if doc.exists}
+
+            batch = adb.batch()
+            for code in candidates - existing:
+                batch.create(pool.document(code), {
+                    'code': code,
+                    'created_at': firestore.SERVER_TIMESTAMP,
+                })
+            await batch.commit()
+            added += len(candidates - existing)
+
+        _set_pool_depth(depth + added)
+        _count_pool_event('refilled', added)
+        if added:
+            print(f"[CODE POOL] {added} ta kod qo'shildi (jami: {depth + added})")
+        return added
+
+
+def _schedule_refill():
+    task = asyncio.get_running_loop().create_task(refill_code_pool())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def code_pool_worker(interval=300):
+    """Poolni vaqti-vaqti bilan tekshirib, kam qolsa to'ldirish"""
+    while True:
+        try:
+            depth = await get_code_pool_depth()
+            if depth < CODE_POOL_LOW_WATERMARK:
+                await refill_code_pool()
+        except Exception as e:
+            print(f"[CODE POOL] Worker xatosi: {e}")
+        await asyncio.sleep(interval)
+
+
+# ============================================================
+# MUKOFOT BERISH
+# ============================================================
+
+@async_transactional
+async def _issue_reward(transaction, user, task_version, coins, start_ref, fallback_code):
+    user_ref = adb.collection('bot_users').document(str(user.id))
+    user_doc = await user_ref.get(transaction=transaction)
+    user_data = user_doc.to_dict() if user_doc.exists else {}
+    # Idempotentlik kaliti: (user, task_version) - kod berilgan bo'lsa o'sha qaytadi
+    if user_data.get('completed_version') == task_version and user_data.get('last_code'):
+        return user_data['last_code'], False
+
+    pool = adb.collection('promo_code_pool')
+    # Tasodifiy joydan boshlab olish - parallel tranzaksiyalar bir xil kodga urilmasin
+    query = pool.where(filter=FieldFilter('__name__', '>=', start_ref)).limit(1)
+    docs = [doc async for doc in query.stream(transaction=transaction)]
+    if not docs:
+        docs = [doc async for doc in pool.limit(1).stream(transaction=transaction)]
+
+    if docs:
+        code = docs[0].id
+        transaction.delete(docs[0].reference)
+    elif fallback_code:
+        code = fallback_code
+    else:
+        return None, False
+
+    transaction.create(
+        adb.collection('promo_codes').document(code),
+        promo_code_data(code, user, task_version, coins),
+    )
+    transaction.set(user_ref, {
+        'telegram_uid': str(user.id),
+        'telegram_name': user.full_name,
+        'completed_version': task_version,
+        'last_code': code,
+        'has_unused_code': True,
+        'updated_at': firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+    return code, True
+
+
+async def issue_reward(user, task_version, coins):
+    """Promo kod berish va userni bajargan deb belgilash - bitta tranzaksiyada.
+
+    Qayta (yoki parallel) bosishlarda yangi kod yaratilmaydi, o'sha kod qaytadi.
+    Natija: (kod, yangi_berildimi)
+    """
+    fallback_code = None
+    for _ in range(5):
+        start_ref = adb.collection('promo_code_pool').document(random_promo_code())
+        try:
+            code, created = await _issue_reward(
+                adb.transaction(), user, task_version, coins, start_ref, fallback_code
+            )
+        except Conflict:
+            # Kod eski tasodifiy kodlardan biri bilan to'qnashdi
+            print(f"[REWARD] Kod band, qayta urinilmoqda (user {user.id})")
+            fallback_code = await generate_promo_code()
+            continue
+
+        if code is None:
+            # Pool bo'sh - zaxira kod bilan qayta urinish
+            fallback_code = await generate_promo_code()
+            continue
+
+        if created and code == fallback_code:
+            _count_pool_event('fallback')
+        elif created:
+            _count_pool_event('claimed')
+            if code_pool_stats['depth']:
+                _set_pool_depth(code_pool_stats['depth'] - 1)
+
+        depth = code_pool_stats['depth']
+        if depth is None or depth < CODE_POOL_LOW_WATERMARK:
+            _schedule_refill()
+        return code, created
+
+    raise RuntimeError("Promo kod berib bo'lmadi")
+
+
+# ============================================================
+# PROMO KODNI ISHLATISH (TDM Training ilovasi API si)
+# ============================================================
+
+async def get_promo_code(code):
+    doc = await adb.collection('promo_codes').document(code).get()
+    return doc.to_dict() if doc.exists else None
+
+
+@async_transactional
+async def _redeem_promo_code(transaction, ref, used_by):
+    snapshot = await ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return 'not_found', None
+    data = snapshot.to_dict()
+    if data.get('used'):
+        # Shu user qayta yuborsa (masalan tarmoq xatosidan keyin) - muvaffaqiyat
+        return ('redeemed' if data.get('used_by') == used_by else 'already_used'), data
+
+    # Egasida boshqa ishlatilmagan kod qolmasa - has_unused_code shu tranzaksiyada o'chadi
+    owner = data.get('telegram_uid')
+    if owner:
+        others = adb.collection('promo_codes').where(
+            filter=FieldFilter('telegram_uid', '==', owner)
+        ).where(filter=FieldFilter('used', '==', False)).limit(2)
+        unused = [doc.id async for doc in others.stream(transaction=transaction)]
+    transaction.update(ref, {'used': True, 'used_by': used_by, 'used_at': firestore.SERVER_TIMESTAMP})
+    if owner and not set(unused) - {ref.id}:
+        transaction.set(adb.collection('bot_users').document(owner), {'has_unused_code': False}, merge=True)
+    return 'redeemed', {**data, 'used': True, 'used_by': used_by}
+
+
+async def redeem_promo_code(code, used_by):
+    """Kodni atomar ishlatish (kod + egasining boshqa kodlari o'qiladi). Natija: (status, kod ma'lumoti)"""
+    ref = adb.collection('promo_codes').document(code)
+    return await _redeem_promo_code(adb.transaction(), ref, used_by)
+
+
+async def save_redemption_audit(entries):
+    """Ishlatish urinishlarini bitta batch bilan promo_redemptions ga yozish"""
+    batch = adb.batch()
+    for entry in entries:
+        batch.set(adb.collection('promo_redemptions').document(), {
+            **entry,
+            'created_at': firestore.SERVER_TIMESTAMP,
+        })
+    await batch.commit()
+
+
+# ============================================================
+# BROADCAST JOBLARI (broadcast_jobs)
+# ============================================================
+#
+# Bir nechta instans (webhook + load balancer) bo'lsa ham jobni faqat bittasi yuboradi:
+# egasi (owner) lease_until gacha ushlab turadi va har sahifa checkpointida uzaytiradi.
+# Lease tugagan jobni boshqa instans oladi; shuncha marta qayta olinib ham sahifa
+# saqlanmasa (har safar yiqilsa) job 'failed' bo'ladi.
+
+BROADCAST_LEASE_SECONDS = int(os.getenv("BROADCAST_LEASE_SECONDS", 300))
+BROADCAST_MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", 5))
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{random.getrandbits(32):08x}"
+
+
+def _lease_until():
+    return datetime.now(timezone.utc) + timedelta(seconds=BROADCAST_LEASE_SECONDS)
+
+
+async def create_broadcast_job(job):
+    """job: text, segment, task_version, total, admin_chat_id, status_message_id (shu instans egasi)"""
+    _, ref = await adb.collection('broadcast_jobs').add({
+        **job,
+        'status': 'running',
+        'cursor': None,
+        'sent': 0,
+        'failed': 0,
+        'blocked': 0,
+        'owner': INSTANCE_ID,
+        'lease_until': _lease_until(),
+        'attempts': 1,
+        'created_at': firestore.SERVER_TIMESTAMP,
+        'updated_at': firestore.SERVER_TIMESTAMP,
+    })
+    return ref.id
+
+
+@async_transactional
+async def _claim_broadcast_job(transaction, ref):
+    snapshot = await ref.get(transaction=transaction)
+    data = snapshot.to_dict() if snapshot.exists else {}
+    if data.get('status') != 'running':
+        return None
+    lease_until = data.get('lease_until')
+    if data.get('owner') and lease_until and lease_until > datetime.now(timezone.utc):
+        return None
+    attempts = data.get('attempts', 0) + 1
+    if attempts > BROADCAST_MAX_ATTEMPTS:
+        transaction.update(ref, {
+            'status': 'failed',
+            'owner': None,
+            'lease_until': None,
+            'updated_at': firestore.SERVER_TIMESTAMP,
+        })
+        print(f"[BROADCAST] Job {ref.id}: {attempts - 1} urinishda tugamadi - failed")
+        return None
+    fields = {'owner': INSTANCE_ID, 'lease_until': _lease_until(), 'attempts': attempts}
+    transaction.update(ref, {**fields, 'updated_at': firestore.SERVER_TIMESTAMP})
+    return {**data, **fields}
+
+
+async def claim_broadcast_job(job_id):
+    """Lease i tugagan 'running' jobni shu instansga olish. Natija: job yoki None (band/tugagan)"""
+    ref = adb.collection('broadcast_jobs').document(job_id)
+    return await _claim_broadcast_job(adb.transaction(), ref)
+
+
+@async_transactional
+async def _checkpoint_broadcast_job(transaction, ref, data, release):
+    snapshot = await ref.get(transaction=transaction)
+    if not snapshot.exists or snapshot.get('owner') != INSTANCE_ID:
+        return False
+    fields = {**data, 'updated_at': firestore.SERVER_TIMESTAMP}
+    if release:
+        fields.update({'owner': None, 'lease_until': None})
+    else:
+        # Sahifa saqlandi - lease uzayadi, urinishlar qaytadan sanaladi
+        fields.update({'lease_until': _lease_until(), 'attempts': 1})
+    transaction.update(ref, fields)
+    return True
+
+
+async def update_broadcast_job(job_id, data, release=False):
+    """Egasi bo'lsa jobni yangilash va lease ni uzaytirish (release - bo'shatish).
+
+    False - job boshqa instansga o'tgan, yuborishni to'xtatish kerak.
+    """
+    ref = adb.collection('broadcast_jobs').document(job_id)
+    return await _checkpoint_broadcast_job(adb.transaction(), ref, data, release)
+
+
+async def get_unfinished_broadcast_jobs():
+    query = adb.collection('broadcast_jobs').where(filter=FieldFilter('status', '==', 'running'))
+    return [(doc.id, doc.to_dict()) async for doc in query.stream()]
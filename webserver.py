@@ -0,0 +1,104 @@
+import asyncio
+from http import HTTPStatus
+
+
+# ============================================================
+# KICHIK ASYNCIO HTTP SERVER
+# ============================================================
+#
+# Health check va Telegram webhook bot bilan bitta event loop va bitta portda ishlaydi.
+# Faqat bizga kerakli qism: Content-Length bilan body, keep-alive, chunked yo'q.
+
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADER_LINES = 100
+KEEPALIVE_TIMEOUT = 75
+
+
+class Request:
+    def __init__(self, method, path, query, headers, body, remote=None):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        # Mijoz IP manzili (proxy ortida X-Forwarded-For ni ham ko'ring)
+        self.remote = remote
+
+
+def text_response(body, status=200, content_type="text/plain; charset=utf-8"):
+    if isinstance(body, str):
+        body = body.encode()
+    return status, content_type, body
+
+
+async def _read_request(reader):
+    request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+    if not request_line:
+        return None
+    method, target, _ = request_line.decode('latin-1').split(' ', 2)
+    path, _, query = target.partition('?')
+
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length') or 0)
+    if length > MAX_BODY_SIZE:
+        raise ValueError("Body juda katta")
+    body = await reader.readexactly(length) if length else b''
+    return Request(method.upper(), path, query, headers, body)
+
+
+def _write_response(writer, status, content_type, body, keep_alive):
+    phrase = HTTPStatus(status).phrase
+    writer.write(
+        f"HTTP/1.1 {status} {phrase}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n".encode('latin-1') + body
+    )
+
+
+async def start_http_server(routes, port, host="0.0.0.0"):
+    """routes: {(method, path): async handler(request) -> (status, content_type, body)}"""
+
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    _write_response(writer, 400, "text/plain", b"Bad Request", False)
+                    break
+                if request is None:
+                    break
+                request.remote = (writer.get_extra_info('peername') or ('',))[0]
+
+                handler = routes.get((request.method, request.path))
+                if handler is None:
+                    allowed = any(path == request.path for _, path in routes)
+                    status, content_type, body = (405, "text/plain", b"Method Not Allowed") if allowed \
+                        else (404, "text/plain", b"Not Found")
+                else:
+                    try:
+                        status, content_type, body = await handler(request)
+                    except Exception as e:
+                        print(f"[HTTP] {request.method} {request.path}: {e}")
+                        status, content_type, body = 500, "text/plain", b"Internal Server Error"
+
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                _write_response(writer, status, content_type, body, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle_connection, host, port)